@@ -0,0 +1,181 @@
+import json
+
+import numpy as np
+
+# ----------------------------
+# Real-time budget controller settings
+# ----------------------------
+BUDGET_MIN_STEP = 1                       # detection interval limits (source frames)
+BUDGET_MAX_STEP = 12
+BUDGET_IMGSZ_LEVELS = (320, 416, 512)  # reduced inference sizes, fastest first (above them: model default)
+BUDGET_HIGH = 1.10      # over budget when smoothed time > budget * HIGH
+BUDGET_LOW = 0.70       # under budget when smoothed time < budget * LOW
+BUDGET_PATIENCE = 8     # consecutive samples outside the band before acting
+BUDGET_EMA = 0.25       # smoothing of the measured time per sample
+BUDGET_WARMUP = 2       # first samples are not measured (model load, first inference)
+
+
+class BudgetController:
+    """
+    Keeps processing within a time budget by adjusting the detection interval
+    (step) and the inference image size.
+
+    Budget per analysed frame = step / target_fps (keep up with the source),
+    optionally capped by max_latency (seconds per analysed frame, live use).
+    Over budget: back up to the base step first, then lower the resolution, then analyse fewer frames.
+    Under budget: analyse more frames first (back to the base step), then raise the resolution.
+    The step is only lowered when the measured time fits the smaller budget, so a
+    change never jumps straight over the dead band into the opposite direction.
+    While max_latency is the binding limit only the resolution changes: a larger step
+    does not make a single analysed frame any faster.
+    The top resolution is the model's own default (imgsz None: nothing passed to YOLO);
+    only BUDGET_IMGSZ_LEVELS below default_imgsz are used.
+    Hysteresis: a dead band (BUDGET_LOW..BUDGET_HIGH) plus BUDGET_PATIENCE samples
+    before acting; the measurement restarts after every change.
+    """
+    def __init__(self, target_fps, step, max_latency=None, min_step=BUDGET_MIN_STEP, max_step=BUDGET_MAX_STEP,
+                 imgsz_levels=BUDGET_IMGSZ_LEVELS, default_imgsz=None):
+        """target_fps None: max_latency only. default_imgsz: the model's own inference size"""
+        self.target_fps = float(target_fps) if target_fps else None
+        self.default_imgsz = default_imgsz
+        self.max_latency = max_latency
+        self.base_step = step
+        self.min_step = min(min_step, step)
+        self.max_step = max(max_step, step)
+        self.imgsz_levels = tuple(sorted(size for size in imgsz_levels
+                                         if default_imgsz is None or size < default_imgsz)) + (None,)
+
+        self.step = step
+        self.level = len(self.imgsz_levels) - 1  # start at full resolution
+
+        self.ema = None
+        self.over = 0
+        self.under = 0
+        self.samples = 0
+        self.measured = 0
+        self.warmup_until = BUDGET_WARMUP
+        self.total_time = 0.0
+        self.adjustments = []
+
+    @property
+    def imgsz(self):
+        return self.imgsz_levels[self.level]
+
+    def state_dict(self):
+        """Controller state as NumPy arrays (for checkpoints), adjustments as a JSON string"""
+        return {
+            "counters": np.array([self.step, self.imgsz or 0, self.samples, self.measured], dtype=np.int64),
+            "total_time": np.float64(self.total_time),
+            "adjustments": np.str_(json.dumps(self.adjustments)),
+        }
+
+    def load_state_dict(self, state):
+        step, imgsz, self.samples, self.measured = [int(v) for v in state["counters"]]
+        self.step = step
+        if (imgsz or None) in self.imgsz_levels:
+            self.level = self.imgsz_levels.index(imgsz or None)
+        self.total_time = float(state["total_time"])
+        self.adjustments = json.loads(str(state["adjustments"]))
+
+        # the first samples after a resume load the model again
+        self.warmup_until = self.samples + BUDGET_WARMUP
+        self.ema = None
+        self.over = self.under = 0
+
+    def latency_bound(self, step=None):
+        """True while max_latency (not keeping up with target_fps) sets the budget"""
+        if not self.max_latency:
+            return False
+        return self.target_fps is None or self.max_latency < (step or self.step) / self.target_fps
+
+    def budget(self, step=None):
+        """Seconds per analysed frame at `step` (default: the current step)"""
+        step = step or self.step
+        if self.latency_bound(step):
+            return self.max_latency
+        return step / self.target_fps
+
+    def _fits(self, step):
+        """The measured time would stay within the budget at `step`"""
+        return self.ema < self.budget(step)
+
+    def observe(self, frame_idx, elapsed):
+        """
+        elapsed: wall time spent on the last analysed frame (decode, detect, draw, write)
+        Returns True if step / imgsz changed.
+        """
+        self.samples += 1
+        if self.samples <= self.warmup_until:
+            return False
+        self.measured += 1
+        self.total_time += elapsed
+        self.ema = elapsed if self.ema is None else BUDGET_EMA * elapsed + (1 - BUDGET_EMA) * self.ema
+
+        budget = self.budget()
+        if self.ema > budget * BUDGET_HIGH:
+            self.over += 1
+            self.under = 0
+        elif self.ema < budget * BUDGET_LOW:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+
+        if self.over >= BUDGET_PATIENCE:
+            return self._adjust(frame_idx, "over budget", faster=True)
+        if self.under >= BUDGET_PATIENCE:
+            return self._adjust(frame_idx, "under budget", faster=False)
+        return False
+
+    def _adjust(self, frame_idx, reason, faster):
+        old_step, old_imgsz, budget = self.step, self.imgsz, self.budget()
+
+        if self.latency_bound():
+            if faster and self.level > 0:
+                self.level -= 1
+            elif not faster and self.level < len(self.imgsz_levels) - 1:
+                self.level += 1
+        elif faster:
+            if self.step < self.base_step:
+                self.step += 1
+            elif self.level > 0:
+                self.level -= 1
+            elif self.step < self.max_step:
+                self.step += 1
+        else:
+            if self.step > self.base_step:
+                if self._fits(self.step - 1):
+                    self.step -= 1
+            elif self.level < len(self.imgsz_levels) - 1:
+                self.level += 1
+            elif self.step > self.min_step and self._fits(self.step - 1):
+                self.step -= 1
+
+        measured = self.ema
+        self.ema = None
+        self.over = self.under = 0
+
+        if (self.step, self.imgsz) == (old_step, old_imgsz):
+            return False  # already at the limit
+
+        self.adjustments.append({
+            "frame_idx": frame_idx,
+            "reason": reason,
+            "frame_ms": round(measured * 1000, 1),
+            "budget_ms": round(budget * 1000, 1),
+            "step": [old_step, self.step],
+            "imgsz": [old_imgsz, self.imgsz],
+        })
+        return True
+
+    def summary(self):
+        measured = self.measured
+        return {
+            "target_fps": self.target_fps,
+            "max_latency": self.max_latency,
+            "final_step": self.step,
+            "final_imgsz": self.imgsz,  # None = model default
+            "default_imgsz": self.default_imgsz,
+            "mean_frame_ms": round(self.total_time / measured * 1000, 1) if measured > 0 else None,
+            "adjustments": self.adjustments,
+        }
@@ -0,0 +1,47 @@
+import os
+import zipfile
+import numpy as np
+
+
+def checkpoint_path(output_path: str):
+    return f"{output_path}.ckpt.npz"
+
+
+def save_checkpoint(path: str, sections: dict):
+    """
+    sections: {"tracker": {name: array}, "counter": {...}, ...}
+    Stored as one uncompressed .npz (flat "section.name" keys).
+    Written to a temp file first, so a crash never leaves a half-written checkpoint.
+    """
+    arrays = {}
+    for section, state in sections.items():
+        for name, value in state.items():
+            arrays[f"{section}.{name}"] = np.asarray(value)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str):
+    """Returns {section: {name: array}} or None if there is no usable checkpoint"""
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            sections = {}
+            for key in data.files:
+                section, name = key.split(".", 1)
+                sections.setdefault(section, {})[name] = data[key]
+            return sections
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def remove_checkpoint(path: str):
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,3 +1,8 @@
+import numpy as np
+
+from app.detections import TID, GENDER, MALE, FEMALE
+
+
 class PeopleCounter:
     def __init__(self, line_y):
         self.line_y = line_y
@@ -53,3 +58,89 @@ class PeopleCounter:
             "males": self.males,
             "females": self.females,
         }
+
+
+class DwellCounter:
+    """
+    Entry/exit rule used by the video pipeline (frame numbers are source frames):
+    - entered: ID has existed for min_frames frames
+    - exited: an entered ID has been missing for more than exit_timeout frames
+    State is kept in arrays indexed by track ID (IDs are small sequential ints).
+    """
+    def __init__(self, min_frames=8, exit_timeout=20):
+        self.min_frames = min_frames
+        self.exit_timeout = exit_timeout
+
+        self.total_entered = 0
+        self.total_exited = 0
+
+        self.males = 0
+        self.females = 0
+
+        self.first_seen = np.zeros(0, dtype=np.int64)  # tid -> frame_idx (-1 = never seen)
+        self.last_seen = np.zeros(0, dtype=np.int64)
+        self.counted_entry = np.zeros(0, dtype=bool)
+        self.counted_exit = np.zeros(0, dtype=bool)
+
+    def _grow(self, size):
+        old = len(self.first_seen)
+        if size <= old:
+            return
+        size = max(size, 2 * old, 64)
+        pad = size - old
+        self.first_seen = np.concatenate([self.first_seen, np.full(pad, -1, dtype=np.int64)])
+        self.last_seen = np.concatenate([self.last_seen, np.full(pad, -1, dtype=np.int64)])
+        self.counted_entry = np.concatenate([self.counted_entry, np.zeros(pad, dtype=bool)])
+        self.counted_exit = np.concatenate([self.counted_exit, np.zeros(pad, dtype=bool)])
+
+    def update(self, tracks, frame_idx):
+        """
+        tracks: N x 6 array [x1, y1, x2, y2, tid, gender] (app.detections layout)
+        """
+        tids = tracks[:, TID].astype(np.int64)
+        genders = tracks[:, GENDER].astype(np.int8)
+        if len(tids):
+            self._grow(int(tids.max()) + 1)
+
+        first_seen = self.first_seen
+        new = first_seen[tids] < 0
+        first_seen[tids[new]] = frame_idx
+        self.last_seen[tids] = frame_idx
+
+        enter = ~self.counted_entry[tids] & (frame_idx - first_seen[tids] >= self.min_frames)
+        self.counted_entry[tids[enter]] = True
+        self.total_entered += int(enter.sum())
+        self.males += int((genders[enter] == MALE).sum())
+        self.females += int((genders[enter] == FEMALE).sum())
+
+        # Exit only counts IDs that were already counted as entry
+        gone = self.counted_entry & ~self.counted_exit & (frame_idx - self.last_seen > self.exit_timeout)
+        gone[tids] = False
+        self.counted_exit |= gone
+        self.total_exited += int(gone.sum())
+
+        return {
+            "current_count": len(tids),
+            "total_entered": self.total_entered,
+            "total_exited": self.total_exited,
+            "males": self.males,
+            "females": self.females,
+        }
+
+    def state_dict(self):
+        """Counting state as flat NumPy arrays (for checkpoints)"""
+        return {
+            "totals": np.array([self.total_entered, self.total_exited, self.males, self.females], dtype=np.int64),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "counted_entry": self.counted_entry,
+            "counted_exit": self.counted_exit,
+        }
+
+    def load_state_dict(self, state):
+        self.total_entered, self.total_exited, self.males, self.females = [int(v) for v in state["totals"]]
+
+        self.first_seen = np.array(state["first_seen"], dtype=np.int64)
+        self.last_seen = np.array(state["last_seen"], dtype=np.int64)
+        self.counted_entry = np.array(state["counted_entry"], dtype=bool)
+        self.counted_exit = np.array(state["counted_exit"], dtype=bool)
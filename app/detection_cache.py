@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from app.utils import DETECTION_CACHE_DIR
+
+# Record raw detector output during normal runs (for replay / parameter sweeps)
+DETECTION_CACHE_ENABLED = True
+
+# Analysed frames per chunk file
+CHUNK_SAMPLES = 1024
+
+
+@functools.lru_cache(maxsize=256)
+def _file_hash(path, size, mtime_ns):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def video_hash(path):
+    """Content hash of a video (memoised per path/size/mtime)"""
+    st = os.stat(path)
+    return _file_hash(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def cache_key(input_path, model_path, conf, classes, step):
+    """Detections only depend on the video, the model weights and the detector settings"""
+    st = os.stat(model_path) if os.path.exists(model_path) else None
+    model_id = f"{os.path.basename(str(model_path))}:{st.st_size if st else 0}:{st.st_mtime_ns if st else 0}"
+    settings = json.dumps([video_hash(input_path), model_id, float(conf), list(classes), int(step)])
+    return hashlib.blake2b(settings.encode(), digest_size=16).hexdigest()
+
+
+def cache_dir(key):
+    return os.path.join(DETECTION_CACHE_DIR, key)
+
+
+def has_cache(key):
+    return os.path.isfile(os.path.join(cache_dir(key), "meta.json"))
+
+
+class DetectionCacheWriter:
+    """
+    Writes per-frame detections (N x 6 arrays, app.detections layout) as chunked .npz files:
+      chunk-00000.npz: frame_idx (S,), offsets (S + 1,), dets (K, 6) float32
+    Everything goes to "<key>.partial" first; close() renames it into place,
+    so a cache directory only exists once it is complete.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.final_dir = cache_dir(key)
+        self.dir = f"{self.final_dir}.partial"
+        shutil.rmtree(self.dir, ignore_errors=True)  # left over from an aborted run
+        os.makedirs(self.dir)
+
+        self.chunks = 0
+        self.samples = 0
+        self._frame_idx = []
+        self._dets = []
+
+    def add(self, frame_idx, dets):
+        self._frame_idx.append(frame_idx)
+        self._dets.append(dets)
+        self.samples += 1
+        if len(self._frame_idx) >= CHUNK_SAMPLES:
+            self._flush()
+
+    def _flush(self):
+        if not self._frame_idx:
+            return
+        counts = [len(d) for d in self._dets]
+        with open(os.path.join(self.dir, f"chunk-{self.chunks:05d}.npz"), "wb") as f:
+            np.savez(
+                f,
+                frame_idx=np.array(self._frame_idx, dtype=np.int64),
+                offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                dets=np.concatenate(self._dets).astype(np.float32).reshape(-1, 6),
+            )
+        self.chunks += 1
+        self._frame_idx = []
+        self._dets = []
+
+    def close(self, meta):
+        """meta: fps, width, height, step, frames, model, ... (stored in meta.json)"""
+        self._flush()
+        meta = dict(meta, key=self.key, samples=self.samples, chunks=self.chunks)
+        with open(os.path.join(self.dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.final_dir, ignore_errors=True)
+        os.replace(self.dir, self.final_dir)
+
+    def abort(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def open_writer(key):
+    """Writer for a new cache entry, or None if this key is already cached"""
+    if not DETECTION_CACHE_ENABLED or has_cache(key):
+        return None
+    return DetectionCacheWriter(key)
+
+
+def load_meta(key):
+    path = os.path.join(cache_dir(key), "meta.json")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No cached detections for key {key}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def iter_detections(key):
+    """
+    Yields (frame_idx, skipped, dets) for every analysed frame, one chunk in memory at a time.
+    skipped = source frames between this sample and the next one (as in the live pipeline).
+    """
+    meta = load_meta(key)
+    prev = None
+    for c in range(meta["chunks"]):
+        with np.load(os.path.join(cache_dir(key), f"chunk-{c:05d}.npz")) as data:
+            frame_idx, offsets, dets = data["frame_idx"], data["offsets"], data["dets"]
+
+        for i in range(len(frame_idx)):
+            sample = (int(frame_idx[i]), dets[offsets[i]:offsets[i + 1]])
+            if prev is not None:
+                yield prev[0], sample[0] - prev[0] - 1, prev[1]
+            prev = sample
+
+    if prev is not None:
+        yield prev[0], max(0, meta["frames"] - prev[0]), prev[1]
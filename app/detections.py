@@ -0,0 +1,39 @@
+import numpy as np
+
+# ----------------------------
+# Detection / track array layout
+# ----------------------------
+# One N x 6 float32 array for both:
+#   detections: [x1, y1, x2, y2, conf, gender]
+#   tracks:     [x1, y1, x2, y2, tid,  gender]
+X1, Y1, X2, Y2, CONF, GENDER = range(6)
+TID = CONF
+
+# Gender codes (same as the model classes, see check_classes.py: {0: 'female', 1: 'male'})
+FEMALE = 0
+MALE = 1
+UNKNOWN = -1
+
+GENDER_NAMES = {FEMALE: "female", MALE: "male", UNKNOWN: "unknown"}
+
+
+def empty():
+    return np.zeros((0, 6), dtype=np.float32)
+
+
+def from_yolo(results):
+    """Bulk-convert an ultralytics result (xyxy, conf, cls) to an N x 6 detection array"""
+    if not results or results[0].boxes is None or len(results[0].boxes) == 0:
+        return empty()
+
+    boxes = results[0].boxes
+    dets = np.empty((len(boxes), 6), dtype=np.float32)
+    dets[:, X1:Y2 + 1] = boxes.xyxy.cpu().numpy()
+    dets[:, CONF] = boxes.conf.cpu().numpy()
+    cls = boxes.cls.cpu().numpy()
+    dets[:, GENDER] = np.where((cls == FEMALE) | (cls == MALE), cls, UNKNOWN)
+    return dets
+
+
+def gender_name(code):
+    return GENDER_NAMES.get(int(code), "unknown")
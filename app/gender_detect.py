@@ -29,19 +29,17 @@ def predict_gender_from_crop(crop):
 
 def apply_gender_to_tracks(frame, tracked_objects, tracker):
     """
-    tracked_objects: list[(id, box)]
+    tracked_objects: N x 6 tracks array [x1, y1, x2, y2, tid, gender] (app.detections layout)
     tracker: SimpleIOUTracker
     This sets gender ONCE per id.
     """
 
-    for tid, box in tracked_objects:
+    for x1, y1, x2, y2, tid, _ in tracked_objects.astype(int):
         # If already set to a valid gender, skip
         current_g = tracker.get_gender(tid)
         if current_g in VALID_GENDERS:
             continue
 
-        x1, y1, x2, y2 = [int(v) for v in box]
-
         # clip bounds
         x1 = max(0, x1)
         y1 = max(0, y1)
@@ -1,18 +1,47 @@
-from fastapi import FastAPI, UploadFile, File, Request, HTTPException
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, Body
 from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.concurrency import run_in_threadpool
+import cv2
+import mimetypes
 import os
 import shutil
+import time
+from typing import List, Optional
 
 from app.utils import ensure_dirs, UPLOAD_DIR, OUTPUT_DIR, unique_filename
-from app.pipeline import run_full_pipeline_single
+from app.pipeline import (
+    run_full_pipeline_single, estimate_output_bytes, sampling_plan, detection_cache_key,
+)
+from app.sidecar import run_overlay_pipeline, estimate_sidecar_bytes
+from app.occupancy_store import occupancy_store, validate_camera
+from app.retention import RetentionManager, InsufficientStorageError
+from app.detection_cache import cache_dir, has_cache
+from app.replay import sweep
+from app.model_registry import model_registry, MODEL_PRELOAD
 
 ensure_dirs()
 
+if MODEL_PRELOAD:
+    model_registry.preload()
+
 app = FastAPI(title="People Detection System")
 
+# Disk quota / TTL for uploads/ and outputs/
+retention = RetentionManager()
+
+
+@app.on_event("startup")
+async def start_retention():
+    retention.start()
+
+
+@app.on_event("shutdown")
+async def stop_retention():
+    retention.stop()
+    model_registry.save_speeds()
+
 # Use absolute paths so StaticFiles always points to the correct folders
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -36,6 +65,7 @@ async def upload_video(file: UploadFile = File(...)):
 
     with open(save_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
+    await run_in_threadpool(retention.register, save_path)
 
     return {"status": "uploaded", "filename": filename}
 
@@ -46,16 +76,128 @@ async def preview_page(request: Request, filename: str):
 
 
 @app.get("/process/{filename}")
-async def process_video(filename: str):
-    input_path = os.path.join(UPLOAD_DIR, filename)
+async def process_video(filename: str, sample_fps: Optional[float] = None, camera: Optional[str] = None,
+                        mode: str = "video", realtime: bool = False, budget_fps: Optional[float] = None,
+                        max_latency: Optional[float] = None, tier: Optional[str] = None,
+                        start_time: Optional[float] = None):
+    """
+    sample_fps: analyse only N frames per second (sparse mode for long archive footage)
+    camera: also record occupancy into the long-term heatmap store for this camera
+    start_time: UTC timestamp of the first frame, for occupancy buckets (default: upload mtime)
+    mode: "video" = re-encoded annotated video, "overlay" = source video + sidecar track file
+    realtime / budget_fps / max_latency: adapt the detection interval and inference size to keep
+    up with the source fps / budget_fps, or to stay under max_latency seconds per analysed frame
+    tier: model tier, e.g. "fast" (preview) or "accurate" (final, default); see /models
+    """
+    if mode not in ("video", "overlay"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+    try:
+        model_registry.path(tier)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    budget = dict(realtime=realtime, budget_fps=budget_fps, max_latency=max_latency)
+    if sample_fps and (realtime or budget_fps or max_latency):
+        raise HTTPException(status_code=400, detail="sample_fps cannot be combined with a time budget")
+    if camera is not None:
+        try:
+            validate_camera(camera)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
+    input_path = os.path.join(UPLOAD_DIR, os.path.basename(filename))
+    if not os.path.isfile(input_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    sidecar_filename = f"TRACKS_{os.path.splitext(filename)[0]}.json"
+    sidecar_path = os.path.join(OUTPUT_DIR, sidecar_filename)
     output_filename = f"FINAL_{filename.replace('.mp4','')}.mp4"
     output_path = os.path.join(OUTPUT_DIR, output_filename)
 
-    # Run blocking task in threadpool
-    await run_in_threadpool(run_full_pipeline_single, input_path, output_path)
+    # Pin the upload and the output (with its work files) so eviction leaves them alone while the job runs
+    with retention.in_use(input_path, sidecar_path if mode == "overlay" else output_path):
+        await run_in_threadpool(retention.touch, input_path)
+
+        if mode == "overlay":
+            # No server-side encoding: the browser draws the overlay from the sidecar
+            await _ensure_space(estimate_sidecar_bytes, input_path)
+            summary = await run_in_threadpool(run_overlay_pipeline, input_path, sidecar_path, sample_fps,
+                                              tier=tier, camera=camera, start_time=start_time, **budget)
+            await run_in_threadpool(retention.register, sidecar_path, input_path)
+            await _register_cache(summary, input_path)
+
+            return {
+                "status": "done",
+                "mode": "overlay",
+                "source_video": f"/source/{filename}",
+                "tracks": f"/tracks/{sidecar_filename}",
+                "summary": summary,
+            }
+
+        # Run blocking task in threadpool
+        await _ensure_space(estimate_output_bytes, input_path, sample_fps)
+        summary = await run_in_threadpool(
+            run_full_pipeline_single, input_path, output_path, sample_fps,
+            camera=camera, start_time=start_time, tier=tier, **budget
+        )
+        await run_in_threadpool(retention.register, output_path, input_path)
+        await _register_cache(summary, input_path)
+
+    return {"status": "done", "mode": "video", "output_video": f"/video/{output_filename}", "summary": summary}
+
+
+async def _register_cache(summary, input_path):
+    """Detection caches are evicted like outputs (and together with their upload)"""
+    if summary.get("detection_cache"):
+        await run_in_threadpool(retention.register, cache_dir(summary["detection_cache"]), input_path)
+
+
+async def _ensure_space(estimate, *args):
+    """Check (and if needed free) disk space for a job before it starts"""
+    def check():
+        retention.ensure_space(estimate(*args))
+
+    try:
+        await run_in_threadpool(check)
+    except InsufficientStorageError as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+
+@app.post("/sweep/{filename}")
+async def sweep_settings(filename: str, configs: List[dict] = Body(..., embed=True),
+                         sample_fps: Optional[float] = None, tier: Optional[str] = None):
+    """
+    Replay tracking/counting/heatmap from cached detections for many settings at once, e.g.
+    {"configs": [{"min_frames_to_count": 6}, {"min_frames_to_count": 12, "iou_threshold": 0.3}]}
+    Needs a previous /process run of the same video (same sample_fps and tier).
+    """
+    input_path = os.path.join(UPLOAD_DIR, os.path.basename(filename))
+    if not os.path.isfile(input_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    def run():
+        cap = cv2.VideoCapture(input_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        cap.release()
+        key = detection_cache_key(input_path, sampling_plan(fps, sample_fps)[0], model_registry.path(tier))
+        if not has_cache(key):
+            return None
+        retention.touch(cache_dir(key))
+        return sweep(key, configs)
 
-    return {"status": "done", "output_video": f"/video/{output_filename}"}
+    try:
+        results = await run_in_threadpool(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if results is None:
+        raise HTTPException(status_code=404, detail="No cached detections: process this video first")
+
+    return {"status": "done", "results": results}
+
+
+@app.get("/models")
+async def list_models():
+    """Discovered weights, tier mapping, loaded models and measured speed on this host"""
+    return await run_in_threadpool(model_registry.info)
 
 
 @app.get("/video/{filename}")
@@ -63,6 +205,7 @@ async def stream_video(filename: str):
     file_path = os.path.join(OUTPUT_DIR, filename)
     if not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail="Video not found")
+    await run_in_threadpool(retention.touch, file_path)
 
     return FileResponse(
         file_path,
@@ -71,6 +214,52 @@ async def stream_video(filename: str):
     )
 
 
+@app.get("/tracks/{filename}")
+async def track_sidecar(filename: str):
+    """Sidecar track file of overlay mode"""
+    file_path = os.path.join(OUTPUT_DIR, os.path.basename(filename))
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Tracks not found")
+    await run_in_threadpool(retention.touch, file_path)
+
+    return FileResponse(file_path, media_type="application/json")
+
+
+@app.get("/source/{filename}")
+async def stream_source(filename: str):
+    """Original uploaded video (used by overlay mode)"""
+    file_path = os.path.join(UPLOAD_DIR, os.path.basename(filename))
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Video not found")
+    await run_in_threadpool(retention.touch, file_path)
+
+    return FileResponse(
+        file_path,
+        media_type=mimetypes.guess_type(file_path)[0] or "video/mp4",
+        filename=filename,
+    )
+
+
+@app.get("/heatmap/{camera}")
+async def heatmap_range(camera: str, start: Optional[float] = None, end: Optional[float] = None,
+                        width: int = 640, height: int = 360):
+    """Long-term occupancy heatmap PNG for [start, end) (UTC timestamps, default: last 24h)"""
+    now = time.time()
+    end = end if end is not None else now
+    start = start if start is not None else end - 86400
+    # Nothing is stored before the epoch or far in the future
+    start, end = max(start, 0.0), min(end, now + 86400)
+    if start >= end or not (16 <= width <= 4096 and 16 <= height <= 4096):
+        raise HTTPException(status_code=400, detail="Invalid time range or image size")
+
+    try:
+        png = await run_in_threadpool(occupancy_store.render_png, camera, start, end, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return Response(content=png, media_type="image/png")
+
+
 @app.get("/webcam", response_class=HTMLResponse)
 async def webcam_page(request: Request):
     return templates.TemplateResponse("webcam.html", {"request": request})
@@ -0,0 +1,222 @@
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from ultralytics import YOLO
+
+from app.utils import MODELS_DIR, MODEL_PATH, MODEL_SPEED_PATH
+
+# ----------------------------
+# Model registry settings
+# ----------------------------
+MODEL_MEMORY_BUDGET = 2 * 1024 ** 3  # loaded weights kept in memory (LRU, the last one always stays)
+
+# Tier -> weights file name in models/. Empty entries are picked by file size:
+# fast = smallest weights, accurate = MODEL_PATH (or the largest weights)
+MODEL_TIERS = {"fast": None, "accurate": None}
+DEFAULT_TIER = "accurate"
+
+# Load the tier models when app.main is imported, so workers forked afterwards
+# (gunicorn --preload) share them instead of each loading a copy
+MODEL_PRELOAD = False
+
+YOLO_DEFAULT_IMGSZ = 640     # ultralytics' predict size when the weights do not record one
+
+SPEED_EMA = 0.05             # smoothing of the recorded ms/frame
+SPEED_SAVE_INTERVAL = 30     # seconds between writes of the speed file
+
+
+def _model_bytes(model, path):
+    """Memory held by the loaded weights (parameter tensors), file size as a fallback"""
+    try:
+        return sum(p.numel() * p.element_size() for p in model.model.parameters())
+    except (AttributeError, TypeError):
+        # weights are stored as fp16, loaded as fp32
+        return 2 * os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class ModelRegistry:
+    """
+    Discovers the weights in models/, maps them to speed tiers, and loads each
+    weights file once. Loaded models are kept in an LRU bounded by MODEL_MEMORY_BUDGET.
+
+    preload() before forking workers (e.g. gunicorn --preload) so they share the
+    weights instead of loading their own copy. The measured inference speed of each
+    weights file is recorded per host in cache/model_speed.json.
+    """
+    def __init__(self, models_dir=MODELS_DIR, memory_budget=MODEL_MEMORY_BUDGET,
+                 speed_path=MODEL_SPEED_PATH):
+        self.models_dir = models_dir
+        self.memory_budget = memory_budget
+        self.speed_path = speed_path
+        self.host = socket.gethostname()
+
+        self.weights = None          # discovered weights paths (smallest first)
+        self.tiers = {}              # tier -> weights path
+        self.loaded = OrderedDict()  # weights path -> (model, bytes), least recently used first
+        self.loaded_bytes = 0
+
+        self.speeds = self._load_speeds()  # weights name -> imgsz -> {"ms_per_frame", "frames"}
+        self._speeds_dirty = False
+        self._speeds_saved = time.time()
+        self._lock = threading.RLock()
+
+        # A lock held by another thread at fork time would stay locked in the child
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.RLock()
+
+    # ----------------------------
+    # Discovery / tiers
+    # ----------------------------
+    def refresh(self):
+        """Rescan models/ and rebuild the tier map"""
+        weights = sorted(glob.glob(os.path.join(self.models_dir, "*.pt")), key=os.path.getsize)
+        if not weights:
+            weights = [MODEL_PATH]  # nothing found: keep the configured model (fails on load as before)
+
+        tiers = {}
+        for tier, name in MODEL_TIERS.items():
+            if name:
+                tiers[tier] = os.path.join(self.models_dir, name)
+        tiers.setdefault("fast", weights[0])
+        tiers.setdefault("accurate", MODEL_PATH if MODEL_PATH in weights else weights[-1])
+
+        with self._lock:
+            self.weights = weights
+            self.tiers = tiers
+        return tiers
+
+    def path(self, tier=None):
+        """Weights path for a tier (None = DEFAULT_TIER)"""
+        if self.weights is None:
+            self.refresh()
+        tier = tier or DEFAULT_TIER
+        if tier not in self.tiers:
+            raise ValueError(f"Unknown model tier: {tier} (available: {', '.join(sorted(self.tiers))})")
+        return self.tiers[tier]
+
+    # ----------------------------
+    # Loading (LRU)
+    # ----------------------------
+    def load(self, path):
+        """Loaded YOLO model for a weights file (loaded once, then served from memory)"""
+        path = str(path)
+        with self._lock:
+            entry = self.loaded.get(path)
+            if entry is not None:
+                self.loaded.move_to_end(path)
+                return entry[0]
+
+            model = YOLO(path)
+            size = _model_bytes(model, path)
+            self.loaded[path] = (model, size)
+            self.loaded_bytes += size
+
+            # Evict least recently used models (jobs still running keep their own reference)
+            while self.loaded_bytes > self.memory_budget and len(self.loaded) > 1:
+                _, (_, old_size) = self.loaded.popitem(last=False)
+                self.loaded_bytes -= old_size
+            return model
+
+    def get(self, tier=None):
+        return self.load(self.path(tier))
+
+    def default_imgsz(self, path):
+        """Inference size the weights use when no imgsz is passed (their training size)"""
+        imgsz = getattr(self.load(path), "overrides", {}).get("imgsz") or YOLO_DEFAULT_IMGSZ
+        return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def preload(self, tiers=None):
+        """
+        Load tier models up front (call before forking workers). Parameters are
+        moved to shared memory where torch allows it, so forked workers keep
+        sharing them even after the parent touches the objects.
+        """
+        if self.weights is None:
+            self.refresh()
+        for tier in tiers or list(self.tiers):
+            model = self.get(tier)
+            try:
+                model.model.share_memory()
+            except AttributeError:
+                pass
+
+    # ----------------------------
+    # Speed per host
+    # ----------------------------
+    def _load_speeds(self):
+        try:
+            with open(self.speed_path) as f:
+                return json.load(f).get(self.host, {})
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, path, imgsz, seconds):
+        """Add one inference timing (seconds per frame) for a weights file at an inference size"""
+        name = os.path.basename(str(path))
+        with self._lock:
+            entry = self.speeds.setdefault(name, {}).setdefault(str(imgsz or "default"),
+                                                                {"ms_per_frame": None, "frames": 0})
+            ms = seconds * 1000
+            if entry["ms_per_frame"] is None:
+                entry["ms_per_frame"] = ms
+            else:
+                entry["ms_per_frame"] = SPEED_EMA * ms + (1 - SPEED_EMA) * entry["ms_per_frame"]
+            entry["frames"] += 1
+            self._speeds_dirty = True
+            due = time.time() - self._speeds_saved >= SPEED_SAVE_INTERVAL
+        if due:
+            self.save_speeds()
+
+    def save_speeds(self):
+        with self._lock:
+            if not self._speeds_dirty:
+                return
+            speeds = json.loads(json.dumps(self.speeds))
+            self._speeds_dirty = False
+            self._speeds_saved = time.time()
+
+        # Other hosts sharing the file keep their own entries
+        try:
+            with open(self.speed_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.host] = speeds
+
+        os.makedirs(os.path.dirname(self.speed_path), exist_ok=True)
+        tmp_path = f"{self.speed_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, self.speed_path)
+
+    def info(self):
+        """Weights, tiers, what is loaded and the measured speeds on this host"""
+        self.refresh()
+        with self._lock:
+            return {
+                "host": self.host,
+                "default_tier": DEFAULT_TIER,
+                "tiers": {tier: os.path.basename(p) for tier, p in self.tiers.items()},
+                "weights": [
+                    {
+                        "name": os.path.basename(p),
+                        "bytes": os.path.getsize(p) if os.path.exists(p) else None,
+                        "loaded": p in self.loaded,
+                        "speed": self.speeds.get(os.path.basename(p), {}),
+                    }
+                    for p in self.weights
+                ],
+                "loaded_bytes": self.loaded_bytes,
+                "memory_budget": self.memory_budget,
+            }
+
+
+# Shared by the pipeline, overlay mode and video_processor
+model_registry = ModelRegistry()
@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from app.utils import OCCUPANCY_DIR
+
+# Coarse occupancy grid (rows, cols), values are person-seconds per cell
+GRID_SHAPE = (36, 64)
+
+# Days are stored in fixed-size chunk files
+DAYS_PER_FILE = 1024
+
+# Max number of memory-mapped files kept open at once (bounds memory use)
+MAX_OPEN_FILES = 16
+
+_CAMERA_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_camera(camera):
+    if not _CAMERA_RE.match(camera or ""):
+        raise ValueError(f"Invalid camera id: {camera!r}")
+    return camera
+
+
+def occupancy_grid(boxes, frame_w, frame_h, weight, grid_shape=GRID_SHAPE):
+    """
+    boxes: iterable of [x1, y1, x2, y2] in frame pixels
+    Returns a grid with `weight` added at the cell of each box centre.
+    """
+    grid = np.zeros(grid_shape, dtype=np.float32)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return grid
+
+    gh, gw = grid_shape
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    col = np.clip((cx * gw / frame_w).astype(np.int64), 0, gw - 1)
+    row = np.clip((cy * gh / frame_h).astype(np.int64), 0, gh - 1)
+    np.add.at(grid, (row, col), weight)
+    return grid
+
+
+class OccupancyStore:
+    """
+    Persistent per-camera occupancy, bucketed by UTC time.
+    Layout (one directory per camera, raw float32 memmaps):
+      minutes-<day>.f32   (1440, rows, cols)   one bucket per minute
+      hours-<day>.f32     (24, rows, cols)     hourly rollup
+      days-<chunk>.f32    (DAYS_PER_FILE, rows, cols)   daily rollup
+      jobs.json           per-job progress (so re-processing never adds twice)
+    Rollups are updated on write, so a time-range query only sums a handful
+    of slices (whole days, then whole hours, then the leftover minutes).
+    """
+    def __init__(self, root=OCCUPANCY_DIR, grid_shape=GRID_SHAPE, max_open=MAX_OPEN_FILES):
+        self.root = root
+        self.grid_shape = tuple(grid_shape)
+        self.max_open = max_open
+        self._open = OrderedDict()  # path -> memmap (LRU)
+        self._lock = threading.Lock()
+
+    def _camera_dir(self, camera):
+        return os.path.join(self.root, validate_camera(camera))
+
+    def _map(self, path, buckets, create):
+        mm = self._open.get(path)
+        if mm is not None:
+            self._open.move_to_end(path)
+            return mm
+
+        if not os.path.exists(path):
+            if not create:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            mode = "w+"  # new zero-filled (sparse) file
+        else:
+            mode = "r+"
+
+        mm = np.memmap(path, dtype=np.float32, mode=mode, shape=(buckets,) + self.grid_shape)
+        self._open[path] = mm
+        while len(self._open) > self.max_open:
+            _, old = self._open.popitem(last=False)
+            old.flush()
+        return mm
+
+    def _minutes(self, camera, day, create=False):
+        return self._map(os.path.join(self._camera_dir(camera), f"minutes-{day}.f32"), 1440, create)
+
+    def _hours(self, camera, day, create=False):
+        return self._map(os.path.join(self._camera_dir(camera), f"hours-{day}.f32"), 24, create)
+
+    def _days(self, camera, chunk, create=False):
+        return self._map(os.path.join(self._camera_dir(camera), f"days-{chunk}.f32"), DAYS_PER_FILE, create)
+
+    def add(self, camera, ts, grid):
+        """Append an occupancy grid at UTC timestamp ts (seconds)"""
+        minute = int(ts // 60)
+        day = minute // 1440
+        grid = np.asarray(grid, dtype=np.float32)
+
+        with self._lock:
+            self._minutes(camera, day, create=True)[minute % 1440] += grid
+            self._hours(camera, day, create=True)[(minute % 1440) // 60] += grid
+            self._days(camera, day // DAYS_PER_FILE, create=True)[day % DAYS_PER_FILE] += grid
+
+    def flush(self):
+        with self._lock:
+            for mm in self._open.values():
+                mm.flush()
+
+    # ----------------------------
+    # Recorded jobs
+    # ----------------------------
+    def _jobs_path(self, camera):
+        return os.path.join(self._camera_dir(camera), "jobs.json")
+
+    def _load_jobs(self, camera):
+        try:
+            with open(self._jobs_path(camera)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def job_info(self, camera, job_id):
+        """Progress stored by mark_job (None for a new job)"""
+        with self._lock:
+            return self._load_jobs(camera).get(job_id)
+
+    def has_job(self, camera, job_id):
+        """True if the job's occupancy is fully recorded"""
+        info = self.job_info(camera, job_id)
+        return info is not None and info.get("done", True)
+
+    def mark_job(self, camera, job_id, info=None):
+        """Store a job's progress, e.g. {"written_until": frame_idx, "done": False}"""
+        with self._lock:
+            jobs = self._load_jobs(camera)
+            jobs[job_id] = info or {}
+            path = self._jobs_path(camera)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(jobs, f)
+            os.replace(f"{path}.tmp", path)
+
+    def extent(self, camera):
+        """[first, last) minute with any stored data (None if nothing is stored)"""
+        days = [int(name[8:-4]) for name in os.listdir(self._camera_dir(camera))
+                if name.startswith("minutes-") and name.endswith(".f32")] \
+            if os.path.isdir(self._camera_dir(camera)) else []
+        if not days:
+            return None
+        return min(days) * 1440, (max(days) + 1) * 1440
+
+    def query(self, camera, start_ts, end_ts):
+        """Sum of occupancy over [start_ts, end_ts), minute resolution"""
+        total = np.zeros(self.grid_shape, dtype=np.float64)
+        extent = self.extent(camera)
+        if extent is None:
+            return total
+
+        # Only walk the stored days (bounds the work for any requested range)
+        m = max(int(start_ts // 60), extent[0])
+        m_end = min(int(math.ceil(end_ts / 60)), extent[1])
+
+        with self._lock:
+            while m < m_end:
+                day, in_day = divmod(m, 1440)
+
+                if in_day == 0 and m + 1440 <= m_end:
+                    # run of whole days (within one chunk file)
+                    i = day % DAYS_PER_FILE
+                    k = min((m_end - m) // 1440, DAYS_PER_FILE - i)
+                    mm = self._days(camera, day // DAYS_PER_FILE)
+                    m += k * 1440
+                elif in_day % 60 == 0 and m + 60 <= m_end:
+                    # run of whole hours (within one day)
+                    i = in_day // 60
+                    k = min((m_end - m) // 60, 24 - i)
+                    mm = self._hours(camera, day)
+                    m += k * 60
+                else:
+                    # leftover minutes up to the next hour boundary
+                    i = in_day
+                    k = min(m_end - m, 60 - in_day % 60)
+                    mm = self._minutes(camera, day)
+                    m += k
+
+                if mm is not None:
+                    total += mm[i:i + k].sum(axis=0, dtype=np.float64)
+
+        return total
+
+    def render_png(self, camera, start_ts, end_ts, width=640, height=360):
+        grid = self.query(camera, start_ts, end_ts).astype(np.float32)
+        norm = cv2.normalize(grid, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        colored = cv2.applyColorMap(norm, cv2.COLORMAP_JET)
+        image = cv2.resize(colored, (width, height), interpolation=cv2.INTER_CUBIC)
+        ok, png = cv2.imencode(".png", image)
+        if not ok:
+            raise RuntimeError("Cannot encode heatmap PNG")
+        return png.tobytes()
+
+
+# Shared store (memmaps are opened lazily)
+occupancy_store = OccupancyStore()
@@ -1,12 +1,21 @@
+import asyncio
 import cv2
+import itertools
 import os
 import numpy as np
 import shutil
 import subprocess
-from ultralytics import YOLO
+import time
 
-from app.utils import MODEL_PATH
 from app.tracker import SimpleIOUTracker
+from app import detections as dets
+from app.count import DwellCounter
+from app.checkpoint import checkpoint_path, save_checkpoint, load_checkpoint, remove_checkpoint
+from app.video_processor import SegmentedVideoWriter, ffmpeg_available
+from app.occupancy_store import occupancy_store, occupancy_grid
+from app.detection_cache import cache_key, open_writer, video_hash
+from app.budget import BudgetController
+from app.model_registry import model_registry
 # from app.gender_detect import apply_gender_to_tracks
 
 # ----------------------------
@@ -14,15 +23,23 @@ from app.tracker import SimpleIOUTracker
 # ----------------------------
 SIDEBAR_WIDTH = 320
 
-# Counting
+# Counting (in source frames, tuned for FRAME_SKIP below)
 MIN_FRAMES_TO_COUNT = 8
 EXIT_TIMEOUT = 20
 
+# Tracker (max_lost is in processed frames at FRAME_SKIP)
+TRACKER_IOU_THRESHOLD = 0.35
+TRACKER_MAX_LOST = 25
+
 # Heatmap
 HEATMAP_DECAY = 0.985
 HEATMAP_INTENSITY = 50
 HEATMAP_RADIUS = 80
 
+# Detector (part of the detection cache key)
+DETECT_CONF = 0.25
+DETECT_CLASSES = [0, 1]
+
 # Gender confidence threshold
 GENDER_CONF_TH = 0.55
 
@@ -31,11 +48,23 @@ VALID_GENDERS = {"male", "female"}
 # Processing Speed Settings
 FRAME_SKIP = 3  # Process 1 frame, skip 2 (repeat visualization)
 
+# Frame skipping: cv2 grab() still decodes (it only skips the colour conversion).
+# From this step on the sampler also tries seeking (keyframe + decode up to the target)
+# and keeps whichever of the two measures cheaper for this video.
+SEEK_MIN_STEP = 8
+SEEK_COST_EMA = 0.2
 
-def _draw_sidebar(frame, stats, frame_idx):
-    h, w = frame.shape[:2]
-    out = cv2.copyMakeBorder(frame, 0, 0, 0, SIDEBAR_WIDTH, cv2.BORDER_CONSTANT, value=(40, 40, 40))
+# Sparse sampling (archive footage): analyse only this many frames per second.
+# None = normal mode (every FRAME_SKIP-th frame, output keeps the source fps)
+DEFAULT_SAMPLE_FPS = None
 
+# Checkpoint / resume: save the full pipeline state every N source frames (None = off)
+CHECKPOINT_EVERY = 3000
+CHECKPOINT_FORMAT = 3  # bump when the saved state layout changes
+
+
+def _draw_sidebar(out, w, stats, frame_idx):
+    """Draw the stats into the sidebar of `out` (frame width w + SIDEBAR_WIDTH)"""
     cv2.putText(out, "STATISTICS", (w + 20, 45),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.95, (0, 255, 255), 2)
 
@@ -54,11 +83,100 @@ def _draw_sidebar(frame, stats, frame_idx):
                     cv2.FONT_HERSHEY_SIMPLEX, 0.70, color, 2)
         y += 40
 
-    return out
 
-
-# Load model once at module level
-model = YOLO(MODEL_PATH)
+def sampling_plan(fps, sample_fps):
+    """
+    Returns (step, out_fps, repeat_skipped).
+    step: source frames between two analysed frames.
+    In sparse mode the output only holds the analysed frames (lower fps, same duration).
+    """
+    if not sample_fps or sample_fps <= 0:
+        return FRAME_SKIP, fps, True
+
+    step = max(1, int(round(fps / float(sample_fps))))
+    return step, fps / step, False
+
+
+def _scaled_thresholds(step, min_frames_to_count=MIN_FRAMES_TO_COUNT, exit_timeout=EXIT_TIMEOUT,
+                       max_lost=TRACKER_MAX_LOST):
+    """
+    Adapt counting / tracker limits to the effective analysis rate.
+    Counting limits stay in source frames (same wall-clock meaning) but never
+    drop below what a couple of samples can satisfy; tracker max_lost counts
+    updates, so it is rescaled to cover the same time span.
+    """
+    min_frames = max(min_frames_to_count, step)
+    exit_timeout = max(exit_timeout, 2 * step)
+    max_lost = max(2, int(round(max_lost * FRAME_SKIP / float(step))))
+    return min_frames, exit_timeout, max_lost
+
+
+class OccupancyRecorder:
+    """
+    One job's long-term occupancy: minute -> grid, written to the store on flush().
+    The job (video content + start time) keeps its progress in the store: samples
+    before `written_until` are already stored and are skipped when the job runs
+    again (crash, lost checkpoint), and a finished job records nothing, so
+    re-processing the same footage never adds its occupancy twice.
+    """
+    def __init__(self, camera, input_path, start_time, fps, w, h):
+        self.camera = camera
+        self.start_time = start_time if start_time is not None else os.path.getmtime(input_path)
+        self.fps = fps
+        self.w = w
+        self.h = h
+        self.job_id = f"{video_hash(input_path)}@{self.start_time:.3f}"
+        info = occupancy_store.job_info(camera, self.job_id) or {"done": False}
+        self.recorded_before = info.get("done", True)
+        self.written_until = int(info.get("written_until", 0))  # source frame index, exclusive
+        self.pending = {}
+        self.minute_ts = None      # minute of the last sample
+        self.minute_frame = None   # first sample of that minute
+        self.next_frame = None     # frame after the last sample
+
+    def add(self, result):
+        frame_idx = result["frame_idx"]
+        if self.recorded_before or frame_idx < self.written_until:
+            return
+        ts = self.start_time + (frame_idx - 1) / self.fps
+        minute_ts = (ts // 60) * 60
+        if minute_ts != self.minute_ts:
+            self.minute_ts, self.minute_frame = minute_ts, frame_idx
+        self.next_frame = frame_idx + result["skipped"] + 1
+
+        # each sample stands for itself + the skipped source frames -> person-seconds
+        cell_add = occupancy_grid(result["tracks"][:, dets.X1:dets.Y2 + 1], self.w, self.h,
+                                  (result["skipped"] + 1) / self.fps)
+        if minute_ts in self.pending:
+            self.pending[minute_ts] += cell_add
+        else:
+            self.pending[minute_ts] = cell_add
+
+    def flush(self, keep_current=False):
+        """Write pending minutes (keep_current: except the one still being filled)"""
+        minutes = [m for m in self.pending if not (keep_current and m == self.minute_ts)]
+        if not minutes:
+            return
+        for minute_ts in minutes:
+            occupancy_store.add(self.camera, minute_ts, self.pending.pop(minute_ts))
+        occupancy_store.flush()
+
+        self.written_until = self.minute_frame if self.pending else self.next_frame
+        self._mark(done=False)
+
+    def finish(self):
+        if self.recorded_before:
+            return
+        self.flush()
+        self._mark(done=True)
+
+    def _mark(self, done):
+        occupancy_store.mark_job(self.camera, self.job_id, {
+            "start_time": self.start_time, "written_until": self.written_until, "done": done,
+        })
+
+    def summary(self):
+        return {"camera": self.camera, "start_time": self.start_time, "already_recorded": self.recorded_before}
 
 
 def _run_ffmpeg_faststart(src_path: str, dst_path: str) -> bool:
@@ -101,267 +219,623 @@ def _run_ffmpeg_faststart(src_path: str, dst_path: str) -> bool:
         return False
 
 
-def run_full_pipeline_single(input_path: str, output_path: str):
-    # model is now global
+def _gaussian_blob(radius):
+    # Gaussian blob (thick heatmap like notebook)
+    x = np.arange(0, 2 * radius + 1)
+    y = np.arange(0, 2 * radius + 1)
+    xx, yy = np.meshgrid(x, y)
+    gaussian = np.exp(-((xx - radius) ** 2 + (yy - radius) ** 2) / (2 * (radius / 2.2) ** 2))
+    return gaussian / gaussian.max()
+
+
+class PipelineState:
+    """
+    Everything the pipeline carries from one analysed frame to the next
+    (tracker, counting, heatmap, frame position). Checkpointable via state_dict().
+    Keyword settings default to the module constants (counting/tracker limits
+    are given at FRAME_SKIP and rescaled to `step`); heatmap=False skips the heatmap.
+    With a BudgetController attached (state.budget) step and imgsz change while running.
+    """
+    def __init__(self, w, h, step=FRAME_SKIP, min_frames_to_count=MIN_FRAMES_TO_COUNT,
+                 exit_timeout=EXIT_TIMEOUT, iou_threshold=TRACKER_IOU_THRESHOLD, max_lost=TRACKER_MAX_LOST,
+                 heatmap=True, heatmap_decay=HEATMAP_DECAY, heatmap_intensity=HEATMAP_INTENSITY,
+                 heatmap_radius=HEATMAP_RADIUS):
+        self.w = w
+        self.h = h
+        self.step = step
+        self.base_thresholds = (min_frames_to_count, exit_timeout, max_lost)
+        self.min_frames, self.exit_timeout, self.max_lost = _scaled_thresholds(step, *self.base_thresholds)
+        self.iou_threshold = iou_threshold
+
+        # Tracker (no lap)
+        self.tracker = SimpleIOUTracker(iou_threshold=iou_threshold, max_lost=self.max_lost)
+
+        # Counting states (from your logic)
+        self.counter = DwellCounter(min_frames=self.min_frames, exit_timeout=self.exit_timeout)
+
+        # Heatmap accum
+        self.heatmap = heatmap
+        self.heatmap_decay = heatmap_decay
+        self.heatmap_intensity = heatmap_intensity
+        self.heatmap_radius = heatmap_radius
+        self.heatmap_accum = np.zeros((h, w), dtype=np.float32)
+        self.gaussian = _gaussian_blob(heatmap_radius)
+
+        self.frame_idx = 1  # source index of the next frame to analyse
+        self.samples = 0
+
+        # Adaptive real-time budget (see attach_budget); imgsz None = model default
+        self.budget = None
+        self.imgsz = None
+
+        # Weights path of this job, resolved once from a tier (None = DEFAULT_TIER's weights)
+        self.weights = None
+
+    def set_step(self, step):
+        """Change the detection interval mid-stream (counting/tracker limits follow)"""
+        self.step = step
+        self.min_frames, self.exit_timeout, self.max_lost = _scaled_thresholds(step, *self.base_thresholds)
+        self.tracker.max_lost = self.max_lost
+        self.counter.min_frames = self.min_frames
+        self.counter.exit_timeout = self.exit_timeout
+
+    def update(self, frame_idx, detections):
+        """
+        detections: N x 6 array [x1, y1, x2, y2, conf, gender] (app.detections layout)
+        Returns (tracks, stats), tracks = N x 6 array [x1, y1, x2, y2, tid, gender]
+        """
+        # ----------------------------
+        # TRACK IDs (gender is kept per track by the tracker)
+        # ----------------------------
+        tracks = self.tracker.update(detections)
 
+        # ----------------------------
+        # COUNTING ENTRY/EXIT
+        # ----------------------------
+        # Enter rule: must exist for min_frames frames
+        # Exit rule: entered ID missing more than exit_timeout frames
+        stats = self.counter.update(tracks, frame_idx)
 
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open video: {input_path}")
+        # ----------------------------
+        # HEATMAP UPDATE
+        # ----------------------------
+        if self.heatmap:
+            self._update_heatmap(tracks)
+
+        self.samples += 1
+        return tracks, stats
+
+    def _update_heatmap(self, tracks):
+        h, w = self.h, self.w
+        heatmap_accum = self.heatmap_accum
+        gaussian = self.gaussian
+
+        radius = self.heatmap_radius
+
+        heatmap_accum *= self.heatmap_decay
+        if len(tracks) == 0:
+            return
+
+        # blob centres (same int truncation as drawing)
+        b = tracks[:, dets.X1:dets.Y2 + 1].astype(np.int32)
+        cx = ((b[:, 0] + b[:, 2]) / 2).astype(np.int32)
+        cy = ((b[:, 1] + b[:, 3]) / 2).astype(np.int32)
+
+        # thick gaussian blob add, clipped to the frame
+        x_start = cx - radius
+        y_start = cy - radius
+        gx1 = np.maximum(0, -x_start)
+        gy1 = np.maximum(0, -y_start)
+        gx2 = gaussian.shape[1] - np.maximum(0, x_start + gaussian.shape[1] - w)
+        gy2 = gaussian.shape[0] - np.maximum(0, y_start + gaussian.shape[0] - h)
+
+        for i in np.flatnonzero((gx1 < gx2) & (gy1 < gy2)):
+            xs, ys = x_start[i] + gx1[i], y_start[i] + gy1[i]
+            heatmap_accum[ys:ys + gy2[i] - gy1[i], xs:xs + gx2[i] - gx1[i]] += \
+                gaussian[gy1[i]:gy2[i], gx1[i]:gx2[i]] * self.heatmap_intensity
+
+    def state_dict(self):
+        sections = {
+            "job": {
+                "frame_idx": self.frame_idx,
+                "samples": self.samples,
+                "step": self.step,
+                "imgsz": self.imgsz or 0,
+            },
+            "tracker": self.tracker.state_dict(),
+            "counter": self.counter.state_dict(),
+            "heatmap": {"accum": self.heatmap_accum},
+        }
+        if self.budget is not None:
+            sections["budget"] = self.budget.state_dict()
+        return sections
+
+    def load_state_dict(self, sections):
+        self.frame_idx = int(sections["job"]["frame_idx"])
+        self.samples = int(sections["job"]["samples"])
+        self.set_step(int(sections["job"]["step"]))
+        self.imgsz = int(sections["job"]["imgsz"]) or None
+        if self.budget is not None and "budget" in sections:
+            self.budget.load_state_dict(sections["budget"])
+            self.set_step(self.budget.step)
+            self.imgsz = self.budget.imgsz
+        self.tracker.load_state_dict(sections["tracker"])
+        self.counter.load_state_dict(sections["counter"])
+        self.heatmap_accum[:] = sections["heatmap"]["accum"]
+
+    def summary(self):
+        summary = {
+            "samples": self.samples,
+            "sample_step": self.step,
+            "min_frames_to_count": self.min_frames,
+            "exit_timeout": self.exit_timeout,
+            "tracker_max_lost": self.max_lost,
+            "tracker_iou_threshold": self.iou_threshold,
+            "total_entered": self.counter.total_entered,
+            "total_exited": self.counter.total_exited,
+            "males": self.counter.males,
+            "females": self.counter.females,
+            "model": os.path.basename(self.weights) if self.weights else None,
+        }
+        if self.budget is not None:
+            summary["budget"] = self.budget.summary()
+        return summary
+
+
+def _detect(frame, imgsz=None, weights=None):
+    # ----------------------------
+    # YOLO PERSON DETECTION
+    # ----------------------------
+    # Enable both classes 0 (female) and 1 (male)
+    # Lower confidence to catch more people
+    # Models are loaded once by the registry, which also records their speed on this host
+    kwargs = {"imgsz": imgsz} if imgsz else {}
+    model = model_registry.load(weights)
+    t = time.perf_counter()
+    results = model(frame, conf=DETECT_CONF, classes=DETECT_CLASSES, verbose=False, **kwargs)
+    model_registry.record(weights, imgsz, time.perf_counter() - t)
+
+    # N x 6 [x1, y1, x2, y2, conf, gender], class ids are the gender codes
+    return dets.from_yolo(results)
+
+
+def render_frame(frame, tracks, stats, state, frame_idx):
+    """Draw heatmap box, counting line, boxes and sidebar on a copy (the input frame is left untouched)"""
+    h, w = frame.shape[:2]
+    out = cv2.copyMakeBorder(frame, 0, 0, 0, SIDEBAR_WIDTH, cv2.BORDER_CONSTANT, value=(40, 40, 40))
+    frame = out[:, :w]  # the video part of the canvas (drawing is clipped to it)
 
-    # Read first frame to ensure valid dimensions
-    ret, first_frame = cap.read()
-    if not ret or first_frame is None:
-        cap.release()
-        raise RuntimeError(f"No frames in video: {input_path}")
+    # Render heatmap box
+    heat_norm = cv2.normalize(state.heatmap_accum, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    heat_color = cv2.applyColorMap(heat_norm, cv2.COLORMAP_JET)
 
-    h, w = first_frame.shape[:2]
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    heat_box = cv2.resize(heat_color, (240, 240))
 
-    # Output video size includes sidebar
-    out_w = w + SIDEBAR_WIDTH
-    out_h = h
+    # merge heatmap into bottom-right
+    box_h, box_w = heat_box.shape[:2]
+    x0 = w - box_w - 10
+    y0 = h - box_h - 10
 
-    # Try using H.264 codec directly if available, fallback to mp4v
-    try:
-        fourcc = cv2.VideoWriter_fourcc(*"avc1")
-    except:
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        
-    temp_output_path = f"{output_path}.tmp.mp4" # Ensure extension
-    out = cv2.VideoWriter(temp_output_path, fourcc, fps, (out_w, out_h))
-    if not out.isOpened():
-        # Fallback to mp4v if avc1 failed to open
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        out = cv2.VideoWriter(temp_output_path, fourcc, fps, (out_w, out_h))
-        if not out.isOpened():
-             cap.release()
-             raise RuntimeError(f"Cannot write video: {temp_output_path}")
+    cv2.rectangle(frame, (x0, y0), (x0 + box_w, y0 + box_h), (0, 255, 255), 2)
+    frame[y0:y0 + box_h, x0:x0 + box_w] = heat_box
 
-    # Tracker (no lap)
-    tracker = SimpleIOUTracker(iou_threshold=0.35, max_lost=25)
+    # draw counting line (you can move this if needed)
+    line_y = int(h * 0.55)
+    cv2.line(frame, (0, line_y), (w, line_y), (255, 255, 255), 2)
+
+    # ----------------------------
+    # DRAW BOXES + LABELS
+    # ----------------------------
+    for x1, y1, x2, y2, tid, gender in tracks.astype(np.int64):
+        gender_final = dets.gender_name(gender)
+
+        if gender_final == "male":
+            color = (0, 255, 0)
+        elif gender_final == "female":
+            color = (255, 100, 255)
+        else:
+            color = (200, 200, 200)
+
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, f"ID:{tid} {gender_final.capitalize()}",
+                    (x1, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.55, color, 2)
+
+    # ----------------------------
+    # Sidebar stats
+    # ----------------------------
+    _draw_sidebar(out, w, stats, frame_idx)
+    return out
 
-    # Heatmap accum
-    heatmap_accum = np.zeros((h, w), dtype=np.float32)
 
-    # Gaussian blob (thick heatmap like notebook)
-    x = np.arange(0, 2 * HEATMAP_RADIUS + 1)
-    y = np.arange(0, 2 * HEATMAP_RADIUS + 1)
-    xx, yy = np.meshgrid(x, y)
-    cx0, cy0 = HEATMAP_RADIUS, HEATMAP_RADIUS
-    gaussian = np.exp(-((xx - cx0) ** 2 + (yy - cy0) ** 2) / (2 * (HEATMAP_RADIUS / 2.2) ** 2))
-    gaussian = gaussian / gaussian.max()
-
-    # Counting states (from your logic)
-    frame_idx = 0
-    first_seen = {}
-    last_seen = {}
-    counted_entry = set()
-    counted_exit = set()
-
-    total_entered = 0
-    total_exited = 0
-    males = 0
-    females = 0
-
-    # helper for gender read
-    id_gender_map = {}  # tid -> male/female/unknown
-
-    # Counting line (you can move this if needed)
-    line_y = int(h * 0.55)
+def _seek_read(cap, frame_idx):
+    """Seek to source frame frame_idx (1-based) and read it; None if the seek was not exact"""
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx - 1)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame_idx - 1:
+        return None
+    ret, frame = cap.read()
+    return frame if ret else None
+
+
+def _rewind_past(cap, frame_idx):
+    """Position cap right after source frame frame_idx by rewinding and grabbing forward"""
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != 0:
+        raise RuntimeError("Cannot rewind the video after an inexact seek")
+    for _ in range(frame_idx):
+        if not cap.grab():
+            raise RuntimeError(f"Video ended before frame {frame_idx} after an inexact seek")
+
+
+def _ema(old, new):
+    return new if old is None else SEEK_COST_EMA * new + (1 - SEEK_COST_EMA) * old
 
+
+def _sample_capture(cap, step, frame_idx=1, first_frame=None):
+    """
+    Yields (frame_idx, frame, skipped) from a cv2.VideoCapture, starting at frame_idx.
+    Frames in between two samples are grabbed (decoded, no colour conversion), or for
+    steps >= SEEK_MIN_STEP skipped by seeking when that measures cheaper.
+    step may be a callable returning the current step (adaptive budget).
+    skipped = source frames passed over after this one (known before it is yielded).
+    """
     frame = first_frame
-    last_processed_frame = None  # To hold the last fully processed frame for skipping
-    
-    # Pre-process the first frame to have something to show if we skip initially (unlikely with logic)
-    # But loop structure handles it
-    
+    if frame is None:
+        ret, frame = cap.read()
+        if not ret:
+            return
+
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    grab_cost = None  # seconds per grabbed frame
+    seek_cost = None  # seconds per seek + read
+    seekable = total > 0
+
+    while frame is not None:
+        skipped = 0
+        next_frame = None
+        n = step() if callable(step) else step
+
+        # Seek only well inside the video (the frame count may be an estimate)
+        if seekable and n >= SEEK_MIN_STEP and grab_cost is not None and frame_idx + n < total \
+                and (seek_cost is None or seek_cost < grab_cost * n):
+            t = time.perf_counter()
+            next_frame = _seek_read(cap, frame_idx + n)
+            if next_frame is None:
+                # inexact seek: go back to grabbing from where we were
+                seekable = False
+                if _seek_read(cap, frame_idx) is None:
+                    _rewind_past(cap, frame_idx)
+            else:
+                seek_cost = _ema(seek_cost, time.perf_counter() - t)
+                skipped = n - 1
+
+        if next_frame is None:
+            t = time.perf_counter()
+            while skipped < n - 1 and cap.grab():
+                skipped += 1
+            if skipped:
+                grab_cost = _ema(grab_cost, (time.perf_counter() - t) / skipped)
+
+        yield frame_idx, frame, skipped
+
+        frame_idx += skipped + 1
+        if next_frame is not None:
+            frame = next_frame
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+
+def _sample_iterable(frames, step, frame_idx=1, progress=None):
+    """
+    Same as _sample_capture for any iterable of BGR frames, except that each sample is
+    yielded before the frames after it are pulled, so a live source is not held back by
+    step - 1 frame periods. skipped is therefore the planned count; progress["next"]
+    is the source index after the last frame actually pulled (smaller at the end of a stream).
+    """
+    progress = progress if progress is not None else {}
+    progress["next"] = frame_idx
+    it = iter(frames)
+    for frame in it:
+        skipped = (step() if callable(step) else step) - 1
+        progress["next"] = frame_idx + 1
+        yield frame_idx, frame, skipped
+
+        for _ in range(skipped):
+            if next(it, None) is None:
+                return
+            progress["next"] += 1
+        frame_idx += skipped + 1
+
+
+def _stream_samples(samples, state, render=False):
+    if state.weights is None:
+        state.weights = model_registry.path()
+    budget = state.budget
+    last = time.perf_counter()
+    for frame_idx, frame, skipped in samples:
+        detections = _detect(frame, state.imgsz, state.weights)
+        tracks, stats = state.update(frame_idx, detections)
+        state.frame_idx = frame_idx + skipped + 1
+
+        yield {
+            "frame_idx": frame_idx,
+            "skipped": skipped,
+            "detections": detections,  # raw detector output, N x 6 [x1, y1, x2, y2, conf, gender code]
+            "tracks": tracks,  # N x 6 [x1, y1, x2, y2, tid, gender code]
+            "stats": stats,
+            "frame": render_frame(frame, tracks, stats, state, frame_idx) if render else None,
+        }
+
+        # Budget: measured time covers the whole cycle (grab/decode, detect, draw and the consumer)
+        if budget is not None:
+            now = time.perf_counter()
+            if budget.observe(frame_idx, now - last):
+                state.set_step(budget.step)
+                state.imgsz = budget.imgsz
+            last = now
+
+
+def attach_budget(state, fps, realtime=False, budget_fps=None, max_latency=None):
+    """
+    Attach a BudgetController to `state` if any budget is requested:
+    realtime (keep up with the source fps), budget_fps (keep up with this rate)
+    and/or max_latency (seconds per analysed frame). Returns the controller or None.
+    The top inference size is the default of the state's weights.
+    """
+    if not (realtime or budget_fps or max_latency):
+        return None
+    if state.weights is None:
+        state.weights = model_registry.path()
+    target_fps = budget_fps or (fps if realtime else None)
+    state.budget = BudgetController(target_fps, state.step, max_latency,
+                                    default_imgsz=model_registry.default_imgsz(state.weights))
+    state.imgsz = state.budget.imgsz
+    return state.budget
+
+
+def stream_pipeline(frames, fps=25.0, sample_fps=DEFAULT_SAMPLE_FPS, render=False, state=None,
+                    realtime=False, budget_fps=None, max_latency=None, tier=None):
+    """
+    Streaming (library) entry point: no files involved.
+
+    frames: cv2.VideoCapture or any iterable of BGR NumPy frames
+    fps: source frame rate (read from the capture when possible)
+    render: also return the annotated frame (with sidebar) in each result
+    state: PipelineState to continue from (e.g. restored from a checkpoint)
+    realtime / budget_fps / max_latency: adapt step and inference size to a time budget
+      (see attach_budget; ignored if the given state already has one)
+    tier: model tier ("fast" / "accurate", see app.model_registry), None = keep the state's weights
+
+    Lazily yields one result dict per analysed frame:
+      {"frame_idx", "skipped", "detections", "tracks", "stats", "frame"}
+    tracks is an N x 6 float32 array [x1, y1, x2, y2, tid, gender code] (see app.detections)
+    From a capture, the frames between two samples are consumed before a result is
+    yielded. From an iterable, each result comes first (no delay on a live source) and
+    "skipped" is the number of frames that will be passed over after it.
+    """
+    is_capture = isinstance(frames, cv2.VideoCapture)
+    if is_capture:
+        fps = frames.get(cv2.CAP_PROP_FPS) or fps
+
+    step = state.step if state is not None else sampling_plan(fps, sample_fps)[0]
+    frame_idx = state.frame_idx if state is not None else 1
+
+    def current_step():
+        return state.step if state is not None else step
+
+    progress = {}
+    if is_capture:
+        samples = _sample_capture(frames, current_step, frame_idx)
+    else:
+        samples = _sample_iterable(frames, current_step, frame_idx, progress)
+
+    if state is None:
+        # Size the state from the first frame
+        first = next(samples, None)
+        if first is None:
+            return
+        h, w = first[1].shape[:2]
+        state = PipelineState(w, h, step)
+        samples = itertools.chain([first], samples)
+
+    if tier is not None:
+        state.weights = model_registry.path(tier)
+    if state.budget is None:
+        attach_budget(state, fps, realtime, budget_fps, max_latency)
+
+    yield from _stream_samples(samples, state, render)
+    if not is_capture:
+        state.frame_idx = progress["next"]  # the stream may end before the planned skip
+
+
+async def astream_pipeline(frames, **kwargs):
+    """Async iterator version of stream_pipeline (each step runs in the default executor)"""
+    loop = asyncio.get_running_loop()
+    it = stream_pipeline(frames, **kwargs)
+    done = object()
     while True:
-        if frame is None:
+        result = await loop.run_in_executor(None, next, it, done)
+        if result is done:
             break
+        yield result
 
-        frame_idx += 1
-        
-        # Frame Skipping Logic:
-        # If not (frame_idx % FRAME_SKIP == 1), just write the last processed frame
-        # We process frame 1, 1+SKIP, etc.
-        # Actually safer to process frame 1.
-        
-        should_process = (frame_idx % FRAME_SKIP == 1) or (FRAME_SKIP == 1)
-
-        if not should_process and last_processed_frame is not None:
-             out.write(last_processed_frame)
-             ret, frame = cap.read()
-             if not ret:
-                 break
-             continue
 
-        # ----------------------------
-        # YOLO PERSON DETECTION
-        # ----------------------------
-        # Enable both classes 0 (female) and 1 (male)
-        # Lower confidence to catch more people
-        results = model(frame, conf=0.25, classes=[0, 1], verbose=False)
-        detections = []
-
-        if results and results[0].boxes is not None:
-            for b in results[0].boxes:
-                coords = b.xyxy[0].tolist()  # [x1, y1, x2, y2]
-                cls_id = int(b.cls[0].item())
-                
-                # Map class to gender
-                # Based on check_classes.py: {0: 'female', 1: 'male'}
-                if cls_id == 0:
-                    g_label = "female"
-                elif cls_id == 1:
-                    g_label = "male"
-                else:
-                    g_label = "unknown"
-                    
-                detections.append((coords, g_label))
+def detection_cache_key(input_path: str, step, weights):
+    """Detection cache key of a job: video + weights + detector settings + step"""
+    return cache_key(input_path, weights, DETECT_CONF, DETECT_CLASSES, step)
 
-        # ----------------------------
-        # TRACK IDs
-        # ----------------------------
-        tracked = tracker.update(detections)
 
-        # ----------------------------
-        # 1) GENDER (Handled in Tracker now)
-        # ----------------------------
-        # apply_gender_to_tracks(frame, tracked, tracker) <--- REMOVED
+def open_detection_cache(input_path: str, step, weights):
+    """Cache writer for this video + weights + detector settings (None if already cached)"""
+    return open_writer(detection_cache_key(input_path, step, weights))
 
-        # Pull gender from tracker into map
-        for tid, _ in tracked:
-            g = tracker.get_gender(tid)
-            if g not in VALID_GENDERS:
-                g = "unknown"
-            id_gender_map[tid] = g
 
-        # ----------------------------
-        # 2) COUNTING ENTRY/EXIT
-        # ----------------------------
-        # update seen times
-        for tid, _ in tracked:
-            if tid not in first_seen:
-                first_seen[tid] = frame_idx
-            last_seen[tid] = frame_idx
-
-            # Enter rule: must exist for MIN_FRAMES_TO_COUNT frames
-            if tid not in counted_entry and (frame_idx - first_seen[tid] >= MIN_FRAMES_TO_COUNT):
-                counted_entry.add(tid)
-                total_entered += 1
-
-                g = id_gender_map.get(tid, "unknown")
-                if g == "male":
-                    males += 1
-                elif g == "female":
-                    females += 1
-
-        # Exit rule: if missing more than EXIT_TIMEOUT frames
-        # We count exit only if it was already counted as entry
-        # active_ids = set([tid for tid, _ in tracked]) # Remove: optimize
-        current_tracked_ids = set(t[0] for t in tracked)
-        
-        for tid in list(last_seen.keys()):
-            if tid in counted_entry and tid not in current_tracked_ids:
-                if (frame_idx - last_seen[tid] > EXIT_TIMEOUT) and (tid not in counted_exit):
-                    counted_exit.add(tid)
-                    total_exited += 1
-
-        current_count = len(tracked)
+def close_detection_cache(writer, state, fps):
+    writer.close({
+        "fps": fps,
+        "width": state.w,
+        "height": state.h,
+        "step": state.step,
+        "frames": state.frame_idx - 1,
+        "model": os.path.basename(state.weights),
+        "conf": DETECT_CONF,
+        "classes": DETECT_CLASSES,
+    })
 
-        # ----------------------------
-        # 3) HEATMAP UPDATE
-        # ----------------------------
-        heatmap_accum *= HEATMAP_DECAY
-
-        for tid, box in tracked:
-            x1, y1, x2, y2 = [int(v) for v in box]
-            cx = int((x1 + x2) / 2)
-            cy = int((y1 + y2) / 2)
-
-            # thick gaussian blob add
-            x_start = cx - HEATMAP_RADIUS
-            y_start = cy - HEATMAP_RADIUS
-            x_end = cx + HEATMAP_RADIUS + 1
-            y_end = cy + HEATMAP_RADIUS + 1
-
-            # clip region
-            gx1, gy1 = 0, 0
-            gx2, gy2 = gaussian.shape[1], gaussian.shape[0]
-
-            if x_start < 0:
-                gx1 = -x_start
-                x_start = 0
-            if y_start < 0:
-                gy1 = -y_start
-                y_start = 0
-            if x_end > w:
-                gx2 = gx2 - (x_end - w)
-                x_end = w
-            if y_end > h:
-                gy2 = gy2 - (y_end - h)
-                y_end = h
-
-            if x_start < x_end and y_start < y_end:
-                heatmap_accum[y_start:y_end, x_start:x_end] += gaussian[gy1:gy2, gx1:gx2] * HEATMAP_INTENSITY
-
-        # Render heatmap box
-        heat_norm = cv2.normalize(heatmap_accum, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        heat_color = cv2.applyColorMap(heat_norm, cv2.COLORMAP_JET)
-
-        heat_box = cv2.resize(heat_color, (240, 240))
-
-        # merge heatmap into bottom-right
-        box_h, box_w = heat_box.shape[:2]
-        x0 = w - box_w - 10
-        y0 = h - box_h - 10
-
-        cv2.rectangle(frame, (x0, y0), (x0 + box_w, y0 + box_h), (0, 255, 255), 2)
-        frame[y0:y0 + box_h, x0:x0 + box_w] = heat_box
-
-        # draw counting line
-        cv2.line(frame, (0, line_y), (w, line_y), (255, 255, 255), 2)
 
-        # ----------------------------
-        # DRAW BOXES + LABELS
-        # ----------------------------
-        for tid, box in tracked:
-            x1, y1, x2, y2 = [int(v) for v in box]
-            gender_final = id_gender_map.get(tid, "unknown")
-
-            if gender_final == "male":
-                color = (0, 255, 0)
-            elif gender_final == "female":
-                color = (255, 100, 255)
-            else:
-                color = (200, 200, 200)
+def estimate_output_bytes(input_path: str, sample_fps=DEFAULT_SAMPLE_FPS):
+    """
+    Rough peak disk use of run_full_pipeline_single: the annotated video is wider
+    (sidebar) and exists twice at the end (segments/temp file + faststart copy).
+    """
+    cap = cv2.VideoCapture(input_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    w = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+    cap.release()
 
-            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(frame, f"ID:{tid} {gender_final.capitalize()}",
-                        (x1, y1 - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.55, color, 2)
+    ratio = (w + SIDEBAR_WIDTH) / w if w > 0 else 1.5
+    if sample_fps:
+        ratio *= min(1.0, sampling_plan(fps, sample_fps)[1] / fps)
+    return int(2 * os.path.getsize(input_path) * ratio)
+
+
+def run_full_pipeline_single(input_path: str, output_path: str, sample_fps=DEFAULT_SAMPLE_FPS,
+                             checkpoint_every=CHECKPOINT_EVERY, resume=True,
+                             camera=None, start_time=None, realtime=False, budget_fps=None, max_latency=None,
+                             tier=None):
+    """
+    File-based wrapper over the streaming pipeline.
+    camera: if set, occupancy is appended to the long-term store for this camera
+    start_time: UTC timestamp of the first frame (default: input file mtime)
+    realtime / budget_fps / max_latency: adaptive step + inference size (see attach_budget),
+      normal mode only: sparse output timing depends on a fixed step
+    tier: model tier ("fast" preview / "accurate" final, see app.model_registry)
+    Checkpoints need ffmpeg (lossless segment concat); without it the output is written
+    in one piece, as before checkpoints existed, and jobs are not resumable.
+    """
+    weights = model_registry.path(tier)  # resolved once per job; unknown tier -> ValueError before any work
+    if not ffmpeg_available():
+        checkpoint_every = None
+        resume = False
 
-        # ----------------------------
-        # Sidebar stats
-        # ----------------------------
-        stats = {
-            "current_count": current_count,
-            "total_entered": total_entered,
-            "total_exited": total_exited,
-            "males": males,
-            "females": females
-        }
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {input_path}")
 
-        final_frame = _draw_sidebar(frame, stats, frame_idx)
-        last_processed_frame = final_frame.copy() # Save for skipping
-        out.write(final_frame)
+    # Read first frame to ensure valid dimensions
+    ret, first_frame = cap.read()
+    if not ret or first_frame is None:
+        cap.release()
+        raise RuntimeError(f"No frames in video: {input_path}")
 
-        ret, frame = cap.read()
-        if not ret:
-            break
+    h, w = first_frame.shape[:2]
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+
+    # Skipped frames are grabbed (decoded, no colour conversion) or passed by seeking
+    step, out_fps, repeat_skipped = sampling_plan(fps, sample_fps)
+    state = PipelineState(w, h, step)
+    state.weights = weights
+    if repeat_skipped:
+        attach_budget(state, fps, realtime, budget_fps, max_latency)
+
+    # Output video size includes sidebar
+    out_w = w + SIDEBAR_WIDTH
+    out_h = h
+
+    temp_output_path = f"{output_path}.tmp.mp4" # Ensure extension
+
+    # Resume only if the checkpoint was made for this exact input + settings
+    ckpt_path = checkpoint_path(output_path)
+    signature = np.array([CHECKPOINT_FORMAT, os.path.getsize(input_path), w, h, step,
+                          state.min_frames, state.exit_timeout, state.max_lost,
+                          os.path.getsize(weights) if os.path.exists(weights) else 0], dtype=np.int64)
+    ckpt = load_checkpoint(ckpt_path) if resume else None
+    if ckpt is not None:
+        job = ckpt.get("job", {})
+        if not np.array_equal(job.get("signature"), signature) or \
+                not all(os.path.exists(str(p)) for p in job.get("segments", [])):
+            ckpt = None
+
+    # Output is written in segments so a resumed job can continue after the last checkpoint
+    segments = [str(p) for p in ckpt["job"]["segments"]] if ckpt is not None else []
+    out = SegmentedVideoWriter(temp_output_path, out_fps, (out_w, out_h), segments)
+
+    if ckpt is not None:
+        state.load_state_dict(ckpt)
+
+        # Seek to the checkpointed frame (keyframe + decode forward to it);
+        # grab through the prefix only if this container cannot seek exactly
+        first_frame = _seek_read(cap, state.frame_idx)
+        if first_frame is None:
+            cap.release()
+            cap = cv2.VideoCapture(input_path)
+            for _ in range(state.frame_idx - 1):
+                cap.grab()
+            ret, first_frame = cap.read()
+            if not ret:
+                first_frame = None
+
+    last_checkpoint = state.frame_idx
+
+    # Long-term occupancy, written to the store at checkpoints (every sample's
+    # completed minutes without checkpoints); the store keeps the job's progress
+    occupancy = OccupancyRecorder(camera, input_path, start_time, fps, w, h) if camera else None
+
+    def current_step():
+        return state.step
+
+    samples = _sample_capture(cap, current_step, state.frame_idx, first_frame) if first_frame is not None else []
+
+    # Detection cache (full runs at a fixed step/size only), for replaying tracking/counting without YOLO
+    cacheable = ckpt is None and state.budget is None
+    cache_writer = open_detection_cache(input_path, step, weights) if cacheable else None
+
+    # We process frame 1, 1+step, 1+2*step, ... (step may vary under a budget)
+    try:
+        for result in _stream_samples(samples, state, render=True):
+            frame_idx = result["frame_idx"]
+            if cache_writer is not None:
+                cache_writer.add(frame_idx, result["detections"])
+
+            if occupancy is not None:
+                occupancy.add(result)
+                if not checkpoint_every:
+                    occupancy.flush(keep_current=True)
+
+            final_frame = result["frame"]
+            out.write(final_frame)
+
+            # Normal mode keeps the source fps: repeat the visualization on skipped frames
+            if repeat_skipped:
+                for _ in range(result["skipped"]):
+                    out.write(final_frame)
+
+            # ----------------------------
+            # Checkpoint (at a sample boundary, output segment closed first)
+            # ----------------------------
+            if checkpoint_every and state.frame_idx - last_checkpoint >= checkpoint_every:
+                out.cut()
+                if occupancy is not None:
+                    occupancy.flush()
+
+                sections = state.state_dict()
+                sections["job"]["signature"] = signature
+                sections["job"]["segments"] = np.array(out.segments, dtype=np.str_)
+                save_checkpoint(ckpt_path, sections)
+                last_checkpoint = state.frame_idx
+    except BaseException:
+        # no half-written cache left behind (retention does not reap the cache dir)
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
 
     cap.release()
-    out.release()
+    if cache_writer is not None:
+        close_detection_cache(cache_writer, state, fps)
+    out.finish(temp_output_path)
+    if occupancy is not None:
+        occupancy.finish()
 
     # Faststart for better HTTP playback
     if os.path.exists(temp_output_path) and os.path.getsize(temp_output_path) == 0:
@@ -378,3 +852,18 @@ def run_full_pipeline_single(input_path: str, output_path: str):
     else:
         if os.path.exists(temp_output_path):
             os.remove(temp_output_path)
+
+    remove_checkpoint(ckpt_path)
+    model_registry.save_speeds()
+
+    summary = {
+        "frames": state.frame_idx - 1,
+        "fps": fps,
+        "output_fps": out_fps,
+        "resumed_from_frame": int(ckpt["job"]["frame_idx"]) if ckpt is not None else None,
+    }
+    summary.update(state.summary())
+    summary["detection_cache"] = detection_cache_key(input_path, step, weights) if cacheable else None
+    if occupancy is not None:
+        summary["occupancy"] = occupancy.summary()
+    return summary
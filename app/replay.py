@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.pipeline import PipelineState
+from app.detection_cache import load_meta, iter_detections
+
+# Settings a replay may override (PipelineState keyword arguments): name -> (type, min, max)
+REPLAY_SETTINGS = {
+    "min_frames_to_count": (int, 1, 100000),
+    "exit_timeout": (int, 1, 100000),
+    "iou_threshold": (float, 0.01, 1.0),
+    "max_lost": (int, 1, 100000),
+    "heatmap": (bool, None, None),
+    "heatmap_decay": (float, 0.0, 1.0),
+    "heatmap_intensity": (float, 0.0, 10000.0),
+    "heatmap_radius": (int, 1, 1000),
+}
+
+# Sweeps share one small worker pool (spawned, so workers never inherit server threads)
+SWEEP_MAX_CONFIGS = 64
+SWEEP_PROCESSES = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def validate_settings(settings):
+    """Raise ValueError for unknown settings or values of the wrong type / out of range"""
+    unknown = set(settings) - set(REPLAY_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown replay settings: {', '.join(sorted(unknown))}")
+
+    for name, value in settings.items():
+        kind, lo, hi = REPLAY_SETTINGS[name]
+        if kind is bool:
+            ok = isinstance(value, bool)
+        elif kind is int:
+            ok = isinstance(value, int) and not isinstance(value, bool) and lo <= value <= hi
+        else:
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool) and lo <= value <= hi
+        if not ok:
+            limits = "true/false" if kind is bool else f"{kind.__name__} in [{lo}, {hi}]"
+            raise ValueError(f"Invalid value for {name}: {value!r} (expected {limits})")
+
+
+def replay(key, **settings):
+    """
+    Re-run tracker + counter + heatmap over cached detections (no video decode, no YOLO).
+    settings: any of REPLAY_SETTINGS, e.g. replay(key, min_frames_to_count=12, iou_threshold=0.3)
+    """
+    validate_settings(settings)
+
+    meta = load_meta(key)
+    state = PipelineState(meta["width"], meta["height"], meta["step"], **settings)
+
+    for frame_idx, skipped, dets in iter_detections(key):
+        state.update(frame_idx, dets)
+        state.frame_idx = frame_idx + skipped + 1
+
+    summary = {"frames": meta["frames"], "settings": settings}
+    summary.update(state.summary())
+    summary["model"] = meta["model"]  # the weights that produced the cache
+    if state.heatmap:
+        summary["heatmap_peak"] = float(state.heatmap_accum.max())
+    return summary
+
+
+def _replay_job(args):
+    key, settings = args
+    return replay(key, **settings)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SWEEP_PROCESSES,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def sweep(key, configs):
+    """Replay many settings dicts on the shared process pool; results keep the configs' order"""
+    global _pool
+    if len(configs) > SWEEP_MAX_CONFIGS:
+        raise ValueError(f"Too many configs: {len(configs)} (max {SWEEP_MAX_CONFIGS})")
+    for settings in configs:
+        if not isinstance(settings, dict):
+            raise ValueError(f"Config must be an object: {settings!r}")
+        validate_settings(settings)
+
+    load_meta(key)  # fail early if nothing is cached
+
+    pool = _get_pool()
+    try:
+        return list(pool.map(_replay_job, [(key, settings) for settings in configs]))
+    except BrokenProcessPool:
+        # a worker died: start a fresh pool next time
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise RuntimeError("Sweep worker crashed")
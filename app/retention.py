@@ -0,0 +1,312 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils import UPLOAD_DIR, OUTPUT_DIR
+
+# ----------------------------
+# Retention settings
+# ----------------------------
+RETENTION_QUOTA_BYTES = 20 * 1024 ** 3      # uploads/ + outputs/ together
+RETENTION_TTL_SECONDS = 7 * 24 * 3600       # unused for this long -> evicted
+RETENTION_INTERVAL_SECONDS = 300            # background eviction period
+MIN_FREE_BYTES = 1 * 1024 ** 3              # disk headroom kept free for everything else
+WORK_GRACE_SECONDS = 3600                   # unpinned work files untouched this long are orphans
+
+INDEX_PATH = os.path.join(OUTPUT_DIR, ".retention.json")
+
+# Work files of jobs (temp output, segments, checkpoints) are not in the index:
+# they are found by scanning, counted against the quota, and evicted once orphaned
+_WORK_MARKERS = (".tmp", ".seg", ".ckpt", ".segments.txt")
+
+
+def _work_owner(name):
+    """Output a work file belongs to ("x.mp4.tmp.mp4.seg0001.mp4" -> "x.mp4"), None if not a work file"""
+    cut = [name.find(m) for m in _WORK_MARKERS if m in name]
+    return name[:min(cut)] if cut else None
+
+
+def _delete(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class InsufficientStorageError(RuntimeError):
+    pass
+
+
+class RetentionManager:
+    """
+    Tracks files in uploads/ and outputs/ in a small JSON index
+    (size, last time served, upload an output was made from), so quota checks
+    never rescan the directories. Evicts least-recently-served outputs together
+    with their uploads, and anything unused for longer than the TTL.
+    """
+    def __init__(self, index_path=INDEX_PATH, quota_bytes=RETENTION_QUOTA_BYTES,
+                 ttl_seconds=RETENTION_TTL_SECONDS, dirs=(UPLOAD_DIR, OUTPUT_DIR)):
+        self.index_path = index_path
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.dirs = dirs
+
+        self.entries = {}   # abs path -> {"size", "last_used", "source"}
+        self.total_bytes = 0
+        self.pinned = {}    # abs path -> count (files used by running jobs)
+        self.work_bytes = 0  # job work files found by the last scan
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._load()
+        self.work_bytes = sum(size for _, size, _ in self._scan_work().values())
+
+    # ----------------------------
+    # Index
+    # ----------------------------
+    def _load(self):
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = {}
+            # drop files removed behind our back
+            self.entries = {p: e for p, e in entries.items() if os.path.exists(p)}
+        else:
+            # First start: seed the index once from what is already on disk
+            now = time.time()
+            for d in self.dirs:
+                for name in os.listdir(d) if os.path.isdir(d) else []:
+                    path = os.path.join(d, name)
+                    if name.startswith(".") or any(m in name for m in _WORK_MARKERS) or not os.path.isfile(path):
+                        continue
+                    st = os.stat(path)
+                    self.entries[path] = {"size": st.st_size, "last_used": min(st.st_mtime, now), "source": None}
+
+        self.total_bytes = sum(e["size"] for e in self.entries.values())
+        self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self.entries)
+            self._dirty = False
+
+        with self._save_lock:
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, self.index_path)
+
+    # ----------------------------
+    # Bookkeeping
+    # ----------------------------
+    def register(self, path, source=None):
+        """
+        Add (or refresh) a finished file or directory (e.g. a detection cache);
+        source = upload an output was made from
+        """
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+        elif os.path.isfile(path):
+            size = os.path.getsize(path)
+        else:
+            return
+
+        with self._lock:
+            old = self.entries.get(path)
+            if old is not None:
+                self.total_bytes -= old["size"]
+            self.entries[path] = {
+                "size": size,
+                "last_used": time.time(),
+                "source": os.path.abspath(source) if source else None,
+            }
+            self.total_bytes += size
+            self._dirty = True
+        self.save()
+
+    def touch(self, path):
+        """
+        Mark a file as just served (persisted by the background thread).
+        Serving an output also keeps the upload it was made from alive.
+        """
+        with self._lock:
+            entry = self.entries.get(os.path.abspath(path))
+            if entry is None:
+                return
+            now = time.time()
+            entry["last_used"] = now
+            source = self.entries.get(entry.get("source"))
+            if source is not None:
+                source["last_used"] = now
+            self._dirty = True
+
+    @contextmanager
+    def in_use(self, *paths):
+        """Pin files while a job uses them, so eviction skips them"""
+        paths = [os.path.abspath(p) for p in paths]
+        with self._lock:
+            for p in paths:
+                self.pinned[p] = self.pinned.get(p, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for p in paths:
+                    self.pinned[p] -= 1
+                    if not self.pinned[p]:
+                        del self.pinned[p]
+
+    # ----------------------------
+    # Eviction
+    # ----------------------------
+    def _drop(self, path, victims):
+        """Take an entry out of the index (file deleted later, outside the lock)"""
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return 0
+        self.total_bytes -= entry["size"]
+        self._dirty = True
+        victims.append(path)
+        return entry["size"]
+
+    def _evict_group(self, path, victims):
+        """Drop an output and its upload (unless another output still uses it)"""
+        source = self.entries.get(path, {}).get("source")
+        freed = self._drop(path, victims)
+        if source and source in self.entries and source not in self.pinned:
+            if not any(e.get("source") == source for e in self.entries.values()):
+                freed += self._drop(source, victims)
+        return freed
+
+    def _scan_work(self):
+        """Work files grouped by the output they belong to: owner -> (paths, bytes, newest mtime)"""
+        groups = {}
+        for d in self.dirs:
+            for name in os.listdir(d) if os.path.isdir(d) else []:
+                owner = _work_owner(name)
+                path = os.path.join(d, name)
+                if owner is None or name.startswith(".") or not os.path.isfile(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                paths, size, newest = groups.get(os.path.join(d, owner), ([], 0, 0.0))
+                groups[os.path.join(d, owner)] = (paths + [path], size + st.st_size, max(newest, st.st_mtime))
+        return groups
+
+    def evict(self, need_bytes=0, free_bytes=0):
+        """
+        Least-recently-served first: evict while an entry is past the TTL,
+        usage + need_bytes is over the quota, or fewer than free_bytes were freed.
+        Orphaned work files (crashed / abandoned jobs) go first.
+        Files are deleted after the lock is released.
+        """
+        removed = []
+        victims = []
+        freed = 0
+        work = self._scan_work()
+        with self._lock:
+            now = time.time()
+            self.work_bytes = sum(size for _, size, _ in work.values())
+
+            # Work files of jobs that are not running here and were not touched for a while.
+            # Checkpoints of crashed jobs are kept for resuming until the TTL, unless space is needed.
+            for owner, (paths, size, newest) in sorted(work.items(), key=lambda item: item[1][2]):
+                if owner in self.pinned or now - newest < WORK_GRACE_SECONDS:
+                    continue
+                expired = self.ttl_seconds and now - newest > self.ttl_seconds
+                over_quota = self.total_bytes + self.work_bytes + need_bytes > self.quota_bytes
+                if not (expired or over_quota or freed < free_bytes):
+                    continue
+                victims += paths
+                self.work_bytes -= size
+                freed += size
+                removed.append(owner)
+
+            # uploads that still have outputs only go together with those outputs
+            sources = set(e["source"] for e in self.entries.values() if e.get("source"))
+            lru = sorted(
+                (p for p in self.entries if p not in self.pinned and p not in sources),
+                key=lambda p: self.entries[p]["last_used"],
+            )
+            for path in lru:
+                entry = self.entries.get(path)
+                if entry is None:
+                    continue  # already removed with its output
+
+                expired = self.ttl_seconds and now - entry["last_used"] > self.ttl_seconds
+                over_quota = self.total_bytes + self.work_bytes + need_bytes > self.quota_bytes
+                if not (expired or over_quota or freed < free_bytes):
+                    break  # everything after this one is newer
+
+                freed += self._evict_group(path, victims)
+                removed.append(path)
+
+        for path in victims:
+            _delete(path)
+        self.save()
+        return removed
+
+    def ensure_space(self, predicted_bytes):
+        """
+        Called before a job starts: make room under the quota and check the
+        disk actually has predicted_bytes free (plus headroom).
+        """
+        if predicted_bytes > self.quota_bytes:
+            # would never fit: fail without evicting anything
+            raise InsufficientStorageError(
+                f"Job needs ~{predicted_bytes // (1024 ** 2)} MB, more than the storage quota"
+            )
+
+        if self.total_bytes + self.work_bytes + predicted_bytes > self.quota_bytes:
+            self.evict(need_bytes=predicted_bytes)
+
+        free = shutil.disk_usage(os.path.dirname(self.index_path)).free
+        if free - predicted_bytes < MIN_FREE_BYTES:
+            self.evict(need_bytes=predicted_bytes, free_bytes=predicted_bytes + MIN_FREE_BYTES - free)
+            free = shutil.disk_usage(os.path.dirname(self.index_path)).free
+
+        if free - predicted_bytes < MIN_FREE_BYTES or \
+                self.total_bytes + self.work_bytes + predicted_bytes > self.quota_bytes:
+            raise InsufficientStorageError(
+                f"Not enough storage for this job (needs ~{predicted_bytes // (1024 ** 2)} MB)"
+            )
+
+    # ----------------------------
+    # Background thread
+    # ----------------------------
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.evict()
+            except OSError as e:
+                print(f"Retention: eviction failed: {e}")
+
+    def start(self, interval=RETENTION_INTERVAL_SECONDS):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save()
@@ -0,0 +1,162 @@
+import base64
+import json
+import os
+
+import cv2
+import numpy as np
+
+from app.pipeline import (
+    stream_pipeline, PipelineState, DEFAULT_SAMPLE_FPS, sampling_plan,
+    open_detection_cache, close_detection_cache, attach_budget, OccupancyRecorder, detection_cache_key,
+)
+from app.model_registry import model_registry
+
+# Heatmap snapshots in the sidecar: coarse grid, one snapshot per N seconds of video
+SIDECAR_HEATMAP_GRID = 24
+SIDECAR_HEATMAP_EVERY_SEC = 1.0
+
+SIDECAR_VERSION = 1
+
+
+def _heatmap_snapshot(heatmap_accum):
+    small = cv2.resize(heatmap_accum, (SIDECAR_HEATMAP_GRID, SIDECAR_HEATMAP_GRID), interpolation=cv2.INTER_AREA)
+    norm = cv2.normalize(small, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return base64.b64encode(norm.tobytes()).decode("ascii")
+
+
+def _encode_tracks(tracks, prev_boxes):
+    """
+    Flat int list: tid, x1, y1, x2, y2, gender per track.
+    Boxes of IDs present in the previous sample are stored as deltas to that box.
+    """
+    flat = []
+    boxes = {}
+    for x1, y1, x2, y2, tid, gender in np.rint(tracks).astype(np.int64).tolist():
+        box = (x1, y1, x2, y2)
+        boxes[tid] = box
+        prev = prev_boxes.get(tid)
+        if prev is not None:
+            box = tuple(v - p for v, p in zip(box, prev))
+        flat.extend((tid,) + box + (gender,))
+    return flat, boxes
+
+
+def estimate_sidecar_bytes(input_path: str):
+    """Generous upper bound for the sidecar size (heatmap snapshots dominate)"""
+    cap = cv2.VideoCapture(input_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    cap.release()
+
+    seconds = max(frames, 0) / fps
+    return int(seconds * 4096) + 65536
+
+
+def run_overlay_pipeline(input_path: str, sidecar_path: str, sample_fps=DEFAULT_SAMPLE_FPS,
+                         realtime=False, budget_fps=None, max_latency=None, tier=None,
+                         camera=None, start_time=None):
+    """
+    Overlay mode: analyse the video but do not re-encode it.
+    Writes a compact sidecar JSON that templates/preview.html draws over the
+    untouched source video:
+
+    {"version", "fps", "width", "height", "step", "heatmap_grid",
+     "frames": [[dframe, tracks, stats, heatmap], ...]}
+
+    dframe   frame_idx minus the previous sample's frame_idx (first: frame_idx)
+    tracks   flat [tid, x1, y1, x2, y2, gender, ...], delta boxes for IDs seen in the previous sample
+    stats    [current, entered, exited, males, females] or 0 if unchanged
+    heatmap  base64 uint8 grid (heatmap_grid x heatmap_grid) or 0 if no new snapshot
+
+    realtime / budget_fps / max_latency: adaptive step + inference size (see pipeline.attach_budget),
+    "step" in the header is then only the starting step.
+    tier: model tier ("fast" / "accurate", see app.model_registry)
+    camera / start_time: record occupancy into the long-term store, as in video mode
+    """
+    weights = model_registry.path(tier)  # resolved once per job
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {input_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if w <= 0 or h <= 0:
+        cap.release()
+        raise RuntimeError(f"Cannot read video size: {input_path}")
+
+    step = sampling_plan(fps, sample_fps)[0]
+    state = PipelineState(w, h, step)
+    state.weights = weights
+    attach_budget(state, fps, realtime, budget_fps, max_latency)
+    cache_writer = open_detection_cache(input_path, step, weights) if state.budget is None else None
+    occupancy = OccupancyRecorder(camera, input_path, start_time, fps, w, h) if camera else None
+    tmp_path = f"{sidecar_path}.tmp"
+
+    prev_idx = 0
+    prev_boxes = {}
+    prev_stats = None
+    next_snapshot = 0.0
+
+    try:
+        with open(tmp_path, "w") as f:
+            header = json.dumps({
+                "version": SIDECAR_VERSION,
+                "fps": fps,
+                "width": w,
+                "height": h,
+                "step": step,
+                "heatmap_grid": SIDECAR_HEATMAP_GRID,
+            }, separators=(",", ":"))
+            f.write(header[:-1] + ',"frames":[')
+
+            for result in stream_pipeline(cap, fps=fps, state=state):
+                if prev_idx:
+                    f.write(",")
+
+                frame_idx = result["frame_idx"]
+                if cache_writer is not None:
+                    cache_writer.add(frame_idx, result["detections"])
+                if occupancy is not None:
+                    occupancy.add(result)
+                    occupancy.flush(keep_current=True)
+                tracks, prev_boxes = _encode_tracks(result["tracks"], prev_boxes)
+
+                stats = [result["stats"][k] for k in ("current_count", "total_entered", "total_exited", "males", "females")]
+                stats_out = stats if stats != prev_stats else 0
+                prev_stats = stats
+
+                heat_out = 0
+                if (frame_idx - 1) / fps >= next_snapshot:
+                    heat_out = _heatmap_snapshot(state.heatmap_accum)
+                    next_snapshot += SIDECAR_HEATMAP_EVERY_SEC
+
+                f.write(json.dumps([frame_idx - prev_idx, tracks, stats_out, heat_out], separators=(",", ":")))
+                prev_idx = frame_idx
+
+            f.write("]}")
+    except BaseException:
+        # no half-written cache left behind (retention does not reap the cache dir)
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise
+
+    cap.release()
+    if not prev_idx:
+        os.remove(tmp_path)
+        if cache_writer is not None:
+            cache_writer.abort()
+        raise RuntimeError(f"No frames in video: {input_path}")
+
+    if cache_writer is not None:
+        close_detection_cache(cache_writer, state, fps)
+    if occupancy is not None:
+        occupancy.finish()
+    os.replace(tmp_path, sidecar_path)
+
+    summary = {"frames": state.frame_idx - 1, "fps": fps, "sidecar_bytes": os.path.getsize(sidecar_path)}
+    summary.update(state.summary())
+    summary["detection_cache"] = detection_cache_key(input_path, step, weights) if state.budget is None else None
+    if occupancy is not None:
+        summary["occupancy"] = occupancy.summary()
+    return summary
@@ -1,3 +1,8 @@
+import numpy as np
+
+from app.detections import X1, Y2, TID, GENDER, UNKNOWN, GENDER_NAMES
+
+
 def iou(a, b):
     x1 = max(a[0], b[0])
     y1 = max(a[1], b[1])
@@ -15,6 +20,20 @@ def iou(a, b):
     return inter / float(area_a + area_b - inter + 1e-6)
 
 
+def iou_matrix(a, b):
+    """Pairwise IOU of boxes a (N x 4) and b (M x 4) -> N x M"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter + 1e-6
+    return np.where(inter > 0, inter / union, 0.0)
+
+
 class SimpleIOUTracker:
     def __init__(self, iou_threshold=0.35, max_lost=30, alpha=0.7):
         self.iou_threshold = iou_threshold
@@ -22,77 +41,125 @@ class SimpleIOUTracker:
         self.alpha = alpha  # Smoothing factor (0.7 means 70% new, 30% old)
 
         self.next_id = 1
-        self.tracks = {}  # id -> {box, lost, gender}
+
+        # Tracks as parallel arrays, in creation order (matching order matters)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.lost = np.zeros(0, dtype=np.int64)
+        self.gender = np.zeros(0, dtype=np.int8)
 
     def update(self, detections):
-        # detections is now expected to be a list of (box, gender_label)
-        
-        if not self.tracks:
-            for box, gender in detections:
-                self.tracks[self.next_id] = {"box": box, "lost": 0, "gender": gender}
-                self.next_id += 1
-            return [(tid, t["box"]) for tid, t in self.tracks.items()]
-
-        assigned = set()
-        results = []
-
-        # Parse inputs
-        # We need to match existing tracks to new detections
-        # det_items = [(box, gender), ...]
-        
-        for det_idx, (box, gender) in enumerate(detections):
-            best_tid = None
-            best_score = 0.0
-
-            for tid, tr in self.tracks.items():
-                if tid in assigned:
-                    continue
-                score = iou(box, tr["box"])
-                if score > best_score:
-                    best_score = score
-                    best_tid = tid
-
-            if best_tid is not None and best_score >= self.iou_threshold:
-                # HIT: Update track
-                
-                # Apply smoothing
-                old_box = self.tracks[best_tid]["box"]
-                new_box = [
-                    self.alpha * box[0] + (1 - self.alpha) * old_box[0],
-                    self.alpha * box[1] + (1 - self.alpha) * old_box[1],
-                    self.alpha * box[2] + (1 - self.alpha) * old_box[2],
-                    self.alpha * box[3] + (1 - self.alpha) * old_box[3]
-                ]
-                
-                self.tracks[best_tid]["box"] = new_box
-                self.tracks[best_tid]["lost"] = 0
-                
-                # Update gender if not set or if needed (here we prioritize known)
-                if self.tracks[best_tid]["gender"] in [None, "unknown"] and gender not in [None, "unknown"]:
-                    self.tracks[best_tid]["gender"] = gender
-                
-                assigned.add(best_tid)
-                results.append((best_tid, new_box))
+        """
+        detections: N x 6 array [x1, y1, x2, y2, conf, gender]
+        Returns tracks for this frame, N x 6 array [x1, y1, x2, y2, tid, gender]
+        (one row per detection, in detection order)
+        """
+        det_boxes = detections[:, X1:Y2 + 1]
+        det_gender = detections[:, GENDER].astype(np.int8)
+        n = len(detections)
+        m = len(self.ids)
+        had_tracks = m > 0  # the very first frame only starts tracks (nothing to match or age)
+
+        # Greedy matching: each detection (in order) takes the best still-free track,
+        # including tracks started by earlier detections of this frame
+        # (e.g. the same person detected as both genders)
+        match = np.full(n, -1, dtype=np.int64)  # track row, new tracks get rows m, m + 1, ...
+        out_boxes = det_boxes.astype(np.float32)
+        scores = iou_matrix(det_boxes, self.boxes) if had_tracks else np.zeros((n, 0))
+        free = np.ones(m, dtype=bool)
+        new_det = []    # detection that started each new track
+        new_boxes = []  # current box of each new track
+        new_free = []
+        for i in range(n):
+            row = np.where(free, scores[i], 0.0)
+            if had_tracks and new_boxes:
+                new_scores = iou_matrix(det_boxes[i:i + 1], np.array(new_boxes, dtype=np.float32))[0]
+                row = np.concatenate([row, np.where(new_free, new_scores, 0.0)])
+            j = int(np.argmax(row)) if len(row) else 0
+            if len(row) and row[j] > 0 and row[j] >= self.iou_threshold:
+                match[i] = j
+                if j < m:
+                    free[j] = False
+                else:
+                    # HIT on a track started this frame: smooth its box, keep the first known gender
+                    k = j - m
+                    new_free[k] = False
+                    new_boxes[k] = self.alpha * det_boxes[i] + (1 - self.alpha) * new_boxes[k]
+                    out_boxes[i] = new_boxes[k]
+                    first = new_det[k]
+                    if det_gender[first] == UNKNOWN and det_gender[i] != UNKNOWN:
+                        det_gender[first] = det_gender[i]
             else:
-                # NEW TRACK
-                self.tracks[self.next_id] = {"box": box, "lost": 0, "gender": gender}
-                results.append((self.next_id, box))
-                self.next_id += 1
+                match[i] = m + len(new_boxes)
+                new_det.append(i)
+                new_boxes.append(det_boxes[i].astype(np.float32))
+                new_free.append(True)
 
-        # Remove lost tracks
-        for tid in list(self.tracks.keys()):
-            if tid not in assigned:
-                self.tracks[tid]["lost"] += 1
-                if self.tracks[tid]["lost"] > self.max_lost:
-                    del self.tracks[tid]
+        hit = (match >= 0) & (match < m)
+        rows = match[hit]
 
-        return results
+        # HIT: smooth box, reset lost, keep the first known gender
+        self.boxes[rows] = self.alpha * det_boxes[hit] + (1 - self.alpha) * self.boxes[rows]
+        out_boxes[hit] = self.boxes[rows]
+        self.lost[rows] = 0
+        take_gender = (self.gender[rows] == UNKNOWN) & (det_gender[hit] != UNKNOWN)
+        self.gender[rows[take_gender]] = det_gender[hit][take_gender]
+
+        # NEW TRACKS
+        new_ids = np.arange(self.next_id, self.next_id + len(new_det), dtype=np.int64)
+        self.next_id += len(new_ids)
+        self.ids = np.concatenate([self.ids, new_ids])
+        self.boxes = np.concatenate([self.boxes, np.array(new_boxes, dtype=np.float32).reshape(-1, 4)])
+        self.lost = np.concatenate([self.lost, np.zeros(len(new_ids), dtype=np.int64)])
+        self.gender = np.concatenate([self.gender, det_gender[new_det].astype(np.int8)])
+
+        tracks = np.empty((n, 6), dtype=np.float32)
+        tracks[:, X1:Y2 + 1] = out_boxes
+        tracks[:, TID] = self.ids[match]
+        tracks[:, GENDER] = self.gender[match]
+
+        # Age every track not matched this frame (new ones included, as before)
+        # and drop the ones lost for too long
+        if had_tracks:
+            aged = np.concatenate([free, np.array(new_free, dtype=bool)])
+            self.lost[aged] += 1
+            keep = self.lost <= self.max_lost
+            self.ids = self.ids[keep]
+            self.boxes = self.boxes[keep]
+            self.lost = self.lost[keep]
+            self.gender = self.gender[keep]
+
+        return tracks
+
+    def _row(self, tid):
+        rows = np.flatnonzero(self.ids == tid)
+        return int(rows[0]) if len(rows) else None
 
     def set_gender(self, tid, gender):
-        if tid in self.tracks:
-            self.tracks[tid]["gender"] = gender
+        row = self._row(tid)
+        if row is not None:
+            codes = {name: code for code, name in GENDER_NAMES.items()}
+            self.gender[row] = codes.get(gender, UNKNOWN)
 
     def get_gender(self, tid):
-        if tid in self.tracks:
-            return self.tracks[tid]["gender"]
+        row = self._row(tid)
+        if row is not None:
+            return GENDER_NAMES[int(self.gender[row])]
         return None
+
+    def state_dict(self):
+        """Tracks as flat NumPy arrays, in creation order"""
+        return {
+            "next_id": np.array(self.next_id, dtype=np.int64),
+            "ids": self.ids,
+            "boxes": self.boxes,
+            "lost": self.lost,
+            "gender": self.gender,
+        }
+
+    def load_state_dict(self, state):
+        self.next_id = int(state["next_id"])
+        self.ids = np.array(state["ids"], dtype=np.int64)
+        self.boxes = np.array(state["boxes"], dtype=np.float32).reshape(-1, 4)
+        self.lost = np.array(state["lost"], dtype=np.int64)
+        self.gender = np.array(state["gender"], dtype=np.int8)
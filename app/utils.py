@@ -5,11 +5,16 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # app/
 
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
-MODEL_PATH = os.path.join(BASE_DIR, "models", "best (1).pt")
+OCCUPANCY_DIR = os.path.join(BASE_DIR, "occupancy")
+DETECTION_CACHE_DIR = os.path.join(BASE_DIR, "cache", "detections")
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+MODEL_PATH = os.path.join(MODELS_DIR, "best (1).pt")
+MODEL_SPEED_PATH = os.path.join(BASE_DIR, "cache", "model_speed.json")
 
 def ensure_dirs():
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(OCCUPANCY_DIR, exist_ok=True)
 
 def unique_filename(original_name: str):
     ext = os.path.splitext(original_name)[1].lower()
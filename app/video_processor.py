@@ -1,8 +1,12 @@
 import cv2
-from ultralytics import YOLO
+import os
+import shutil
+import subprocess
+
+from app.model_registry import model_registry
 
 def yolo_detect_and_track(input_path: str, output_path: str, model_path: str):
-    model = YOLO(model_path)
+    model = model_registry.load(model_path)  # loaded once, shared with the pipeline
 
     cap = cv2.VideoCapture(input_path)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -26,3 +30,103 @@ def yolo_detect_and_track(input_path: str, output_path: str, model_path: str):
 
     cap.release()
     out.release()
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def open_video_writer(path: str, fps: float, size):
+    """Try H.264 (avc1) first, fallback to mp4v"""
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"avc1"), fps, size)
+    if not out.isOpened():
+        out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        if not out.isOpened():
+            raise RuntimeError(f"Cannot write video: {path}")
+    return out
+
+
+class SegmentedVideoWriter:
+    """
+    VideoWriter that writes numbered segment files ("<base>.seg0000.mp4", ...).
+    cut() closes the current segment, so everything written so far is final on disk.
+    This is what makes checkpoint/resume possible (cv2 cannot append to an mp4).
+    Joining several segments needs ffmpeg to stay lossless (the cv2 fallback re-encodes),
+    so only cut() when ffmpeg_available().
+    """
+    def __init__(self, base_path: str, fps: float, size, segments=None):
+        self.base_path = base_path
+        self.fps = fps
+        self.size = size
+        self.segments = list(segments or [])  # completed segment paths
+        self.writer = None
+        self.current_path = None
+
+    def _open_next(self):
+        self.current_path = f"{self.base_path}.seg{len(self.segments):04d}.mp4"
+        self.writer = open_video_writer(self.current_path, self.fps, self.size)
+
+    def write(self, frame):
+        if self.writer is None:
+            self._open_next()
+        self.writer.write(frame)
+
+    def cut(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+            self.segments.append(self.current_path)
+
+    def finish(self, dst_path: str):
+        """Close and join all segments into dst_path"""
+        self.cut()
+        if not self.segments:
+            raise RuntimeError(f"Empty output video: {dst_path}")
+
+        if len(self.segments) == 1:
+            shutil.move(self.segments[0], dst_path)
+        else:
+            if not _concat_with_ffmpeg(self.segments, dst_path):
+                _concat_with_cv2(self.segments, dst_path, self.fps, self.size)
+            self.discard()
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+        for path in self.segments + [self.current_path]:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+def _concat_with_ffmpeg(segments, dst_path: str) -> bool:
+    list_path = f"{dst_path}.segments.txt"
+    with open(list_path, "w") as f:
+        for path in segments:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    try:
+        subprocess.run(
+            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", dst_path],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return True
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return False
+    finally:
+        os.remove(list_path)
+
+
+def _concat_with_cv2(segments, dst_path: str, fps: float, size):
+    # No ffmpeg: decode + re-encode (slow, but only on this fallback path)
+    out = open_video_writer(dst_path, fps, size)
+    for path in segments:
+        cap = cv2.VideoCapture(path)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
@@ -0,0 +1,38 @@
+import random
+
+from app.budget import BudgetController
+
+
+def _run(controller, low, high, samples=3000, seed=0):
+    rng = random.Random(seed)
+    for i in range(samples):
+        controller.observe(i, rng.uniform(low, high))
+    return controller
+
+
+def test_no_oscillation_around_step_boundary():
+    # 25 fps, ~50 ms per analysed frame: step 1 (40 ms) is too tight, step 2 (80 ms) fits
+    budget = _run(BudgetController(25, 3, default_imgsz=640), 0.045, 0.055)
+
+    assert budget.step == 2
+    assert budget.imgsz is None
+    assert len(budget.adjustments) <= 2
+
+
+def test_over_budget_restores_base_step_before_lowering_resolution():
+    budget = BudgetController(25, 3, default_imgsz=640)
+    budget.step = 1
+    _run(budget, 0.2, 0.2, samples=100)
+
+    steps = [a["step"] for a in budget.adjustments]
+    sizes = [a["imgsz"] for a in budget.adjustments]
+    assert steps[:2] == [[1, 2], [2, 3]]
+    assert sizes[2] == [None, 512]
+
+
+def test_max_latency_only_changes_resolution():
+    budget = _run(BudgetController(None, 3, max_latency=0.05, default_imgsz=640), 0.2, 0.2, samples=200)
+
+    assert budget.step == 3
+    assert budget.imgsz == 320
+    assert all(a["step"] == [3, 3] for a in budget.adjustments)